@@ -0,0 +1,110 @@
+import json
+from datetime import date, datetime
+
+from django.core.exceptions import ValidationError
+from django.db.models import F, Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import CursorPagination, Cursor
+
+
+class KeysetCursorPagination(CursorPagination):
+    """
+    Cursor pagination keyed on the ordering field *and* the primary key.
+
+    DRF's CursorPagination only stores the ordering field in the cursor and steps over ties with
+    an offset, which breaks down on non-unique or nullable orderings. Here the cursor holds the
+    `(value, pk)` of the page boundary and the next page is fetched with a row comparison on both,
+    so every page is an index range scan however deep it is. NULLs always sort last. The cursor
+    also holds the ordering it was built for, and is invalid under any other.
+
+    The ordering comes from the view's OrderingFilter when the request sets one; only its first
+    field is used, with the primary key as tie breaker.
+    """
+    ordering = '-created_at'
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)[:1]
+        self.cursor = self.decode_cursor(request)
+        reverse = bool(self.cursor and self.cursor.reverse)
+
+        field = self.ordering[0].lstrip('-')
+        descending = self.ordering[0].startswith('-') != reverse
+        nullable = queryset.model._meta.get_field(field).null
+        nulls_last = not reverse
+        # NULL placement is only spelled out for nullable fields, so plain indexes still match
+        nulls = ({'nulls_last': True} if nulls_last else {'nulls_first': True}) if nullable else {}
+        if descending:
+            queryset = queryset.order_by(F(field).desc(**nulls), '-pk')
+        else:
+            queryset = queryset.order_by(F(field).asc(**nulls), 'pk')
+
+        if self.cursor and self.cursor.position is not None:
+            value, pk = self.decode_position(self.cursor.position, queryset.model, field)
+            queryset = queryset.filter(self.get_keyset_filter(field, descending, nullable and nulls_last, value, pk))
+
+        results = list(queryset[:self.page_size + 1])
+        has_following = len(results) > self.page_size
+        self.page = results[:self.page_size]
+        if reverse:
+            self.page.reverse()
+            self.has_next, self.has_previous = True, has_following
+        else:
+            self.has_next, self.has_previous = has_following, self.cursor is not None
+        return self.page
+
+    def decode_position(self, position, model, field):
+        """The `(value, pk)` page boundary of a cursor, as Python values of the ordering field and pk."""
+        try:
+            ordering, value, pk = json.loads(position)
+            if ordering != self.ordering[0] or pk is None:
+                raise ValueError(position)
+            if value is not None:
+                value = model._meta.get_field(field).to_python(value)
+            pk = model._meta.pk.to_python(pk)
+        except (TypeError, ValueError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+        return value, pk
+
+    @staticmethod
+    def get_keyset_filter(field, descending, nulls_last, value, pk):
+        """
+        Rows coming after `(value, pk)` when ordering by `field` then by primary key, written as
+        `field <= value AND (field < value OR pk < boundary pk)` so the first term bounds an
+        index range scan.
+        """
+        lookup = 'lt' if descending else 'gt'
+        pk_after = Q(**{f'pk__{lookup}': pk})
+        is_null = Q(**{f'{field}__isnull': True})
+        if value is None:
+            return is_null & pk_after if nulls_last else ~is_null | (is_null & pk_after)
+        after = Q(**{f'{field}__{lookup}e': value}) & (Q(**{f'{field}__{lookup}': value}) | pk_after)
+        return after | is_null if nulls_last else after
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(Cursor(offset=0, reverse=False, position=self._get_position(self.page[-1])))
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor(Cursor(offset=0, reverse=True, position=self._get_position(self.page[0])))
+
+    def _get_position(self, instance):
+        field = self.ordering[0].lstrip('-')
+        if isinstance(instance, dict):
+            value, pk = instance[field], instance['pk'] if 'pk' in instance else instance['id']
+        else:
+            value, pk = getattr(instance, field), instance.pk
+        if isinstance(value, (date, datetime)):
+            value = value.isoformat()
+        return json.dumps([self.ordering[0], value, pk])
@@ -70,9 +70,17 @@ MIDDLEWARE = [
 
 CORS_ALLOW_ALL_ORIGINS = True
 CELERY_BROKER_URL = 'redis://localhost:6379/0'
-CELERY_ACCEPT_CONTENT = ['json', 'pickle']
-CELERY_TASK_SERIALIZER = 'pickle'
-CELERY_RESULT_SERIALIZER = 'pickle'
+# Chords (chunked uploads) need a result backend
+CELERY_RESULT_BACKEND = os.getenv('CELERY_RESULT_BACKEND', 'redis://localhost:6379/0')
+CELERY_ACCEPT_CONTENT = ['json']
+CELERY_TASK_SERIALIZER = 'json'
+CELERY_RESULT_SERIALIZER = 'json'
+CELERY_BEAT_SCHEDULE = {
+    'provision-pending-credentials': {
+        'task': 'user.tasks.provision_pending_credentials',
+        'schedule': crontab(minute='*/5'),
+    },
+}
 
 ROOT_URLCONF = "core.urls"
 
@@ -94,6 +102,9 @@ TEMPLATES = [
 
 WSGI_APPLICATION = "core.wsgi.application"
 AUTH_USER_MODEL = "user.User"
+AUTHENTICATION_BACKENDS = [
+    "user.backends.DeferredCredentialBackend",
+]
 
 # Database
 # https://docs.djangoproject.com/en/5.0/ref/settings/#databases
@@ -121,13 +132,38 @@ REST_FRAMEWORK = {
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
     # 'DATE_INPUT_FORMATS': ["%d/%m/%Y", ],
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'user.authentication.StatelessJWTAuthentication',
     ),
     'TEST_REQUEST_DEFAULT_FORMAT': 'json',
     "EXCEPTION_HANDLER": "drf_standardized_errors.handler.exception_handler"
 
 }
 
+CACHES = {
+    'default': {
+        'BACKEND': 'django_redis.cache.RedisCache',
+        'LOCATION': os.getenv('REDIS_URL', 'redis://localhost:6379/1'),
+        'OPTIONS': {
+            'CLIENT_CLASS': 'django_redis.client.DefaultClient',
+        },
+    }
+}
+# Seconds a user's token version stays cached; revocations update it directly
+TOKEN_VERSION_CACHE_TIMEOUT = int(os.getenv('TOKEN_VERSION_CACHE_TIMEOUT', 3600))
+# Seconds a user's role and department stay cached for permission checks
+AUTHORIZATION_CONTEXT_TIMEOUT = int(os.getenv('AUTHORIZATION_CONTEXT_TIMEOUT', 300))
+# Seconds a user list page stays cached; writes to users and departments invalidate it sooner
+USER_LIST_CACHE_TIMEOUT = int(os.getenv('USER_LIST_CACHE_TIMEOUT', 300))
+
+# Rows fetched per round trip by the user export's server-side cursor
+USER_EXPORT_CHUNK_SIZE = int(os.getenv('USER_EXPORT_CHUNK_SIZE', 2000))
+
+# Search backend of the user list, per database vendor
+USER_SEARCH_BACKENDS = {
+    'postgresql': 'user.search.TrigramSearchBackend',
+    'sqlite': 'user.search.FTS5SearchBackend',
+}
+
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
 
@@ -146,6 +182,41 @@ AUTH_PASSWORD_VALIDATORS = [
     },
 ]
 
+# Uploaded students get a bcrypt hash of their matric number as their first password
+PASSWORD_HASHERS = [
+    "django.contrib.auth.hashers.PBKDF2PasswordHasher",
+    "django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher",
+    "django.contrib.auth.hashers.Argon2PasswordHasher",
+    "django.contrib.auth.hashers.BCryptSHA256PasswordHasher",
+    "django.contrib.auth.hashers.BCryptPasswordHasher",
+    "django.contrib.auth.hashers.ScryptPasswordHasher",
+]
+
+# Bulk student upload
+USER_UPLOAD_BATCH_SIZE = int(os.getenv('USER_UPLOAD_BATCH_SIZE', 500))
+USER_UPLOAD_CHUNK_SIZE = int(os.getenv('USER_UPLOAD_CHUNK_SIZE', 10000))
+USER_UPLOAD_CHUNK_CONCURRENCY = int(os.getenv('USER_UPLOAD_CHUNK_CONCURRENCY', 4))
+# Also store the error file as Parquet, next to the CSV
+USER_UPLOAD_ERROR_PARQUET = os.getenv('USER_UPLOAD_ERROR_PARQUET', 'False').lower() == 'true'
+USER_UPLOAD_HASH_WORKERS = int(os.getenv('USER_UPLOAD_HASH_WORKERS', os.cpu_count() or 1))
+# Create students with a pending password, hashed on first login or by the beat sweep below
+USER_UPLOAD_DEFER_PASSWORDS = os.getenv('USER_UPLOAD_DEFER_PASSWORDS', 'False').lower() == 'true'
+# "copy" inserts students through COPY into a staging table on Postgres; "orm" uses bulk_create
+USER_UPLOAD_INGEST_ENGINE = os.getenv('USER_UPLOAD_INGEST_ENGINE', 'orm')
+# Processes the format checks of an upload batch are split across, started once per worker process;
+# below two they run in the worker itself. Celery's prefork pool runs tasks in daemonic processes,
+# which cannot start processes, so this only applies under `--pool threads` or `solo` workers
+USER_UPLOAD_VALIDATION_WORKERS = int(os.getenv('USER_UPLOAD_VALIDATION_WORKERS', 0))
+# Seconds a chunk stays leased to the run processing it, renewed at every batch; other runs of the
+# chunk wait for the lease to expire, and resume_file_uploads only requeues uploads idle this long
+USER_UPLOAD_CHUNK_LEASE_TIMEOUT = int(os.getenv('USER_UPLOAD_CHUNK_LEASE_TIMEOUT', 600))
+USER_PENDING_CREDENTIALS_BATCH_SIZE = int(os.getenv('USER_PENDING_CREDENTIALS_BATCH_SIZE', 1000))
+# Live upload progress is kept in the cache and written to the upload every so many rows
+USER_UPLOAD_PROGRESS_FLUSH_ROWS = int(os.getenv('USER_UPLOAD_PROGRESS_FLUSH_ROWS', 10000))
+USER_UPLOAD_PROGRESS_TIMEOUT = int(os.getenv('USER_UPLOAD_PROGRESS_TIMEOUT', 86400))
+# Seconds before a process reloads its department code lookup
+DEPARTMENT_REGISTRY_TTL = int(os.getenv('DEPARTMENT_REGISTRY_TTL', 300))
+
 # Email Settings
 EMAIL_FROM = os.environ.get('SENDER_EMAIL')
 EMAIL_HOST = os.environ.get('SMTP_HOST')
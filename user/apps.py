@@ -1,6 +1,13 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 
 class UserConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "user"
+
+    def ready(self):
+        from . import schema, signals  # noqa: F401
+        from .search import sync_sqlite_search_index_after_migrate
+
+        post_migrate.connect(sync_sqlite_search_index_after_migrate, sender=self)
@@ -0,0 +1,44 @@
+from django.utils.functional import cached_property
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.settings import api_settings
+
+from user.cache import get_token_version
+
+
+class ClaimsTokenUser(TokenUser):
+    """A user built from the claims of its access token, without loading the `User` row."""
+
+    @cached_property
+    def role(self):
+        return self.token.get('role')
+
+    @cached_property
+    def is_active(self):
+        return self.token.get('is_active', False)
+
+
+class StatelessJWTAuthentication(JWTAuthentication):
+    """
+    JWT authentication that trusts the role and is_active claims of the token instead of loading
+    the user on every request. A token is only accepted while its `token_version` claim matches
+    the user's current one, looked up in the cache, so bumping `User.token_version` revokes it.
+    Tokens issued without the claims still go through the database.
+    """
+
+    def get_user(self, validated_token):
+        if 'token_version' not in validated_token:
+            return super().get_user(validated_token)
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_("Token contained no recognizable user identification"))
+
+        if validated_token['token_version'] != get_token_version(user_id):
+            raise AuthenticationFailed(_("Token has been revoked"), code="token_revoked")
+        user = ClaimsTokenUser(validated_token)
+        if not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+        return user
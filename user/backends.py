@@ -0,0 +1,40 @@
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+from django.utils.crypto import constant_time_compare
+
+from .utils import provision_pending_password
+
+UserModel = get_user_model()
+
+
+class DeferredCredentialBackend(ModelBackend):
+    """
+    Model backend that also authenticates students uploaded with deferred credentials: while
+    their password is pending, the matric number is accepted and hashed into their password.
+    """
+
+    def authenticate(self, request, username=None, password=None, **kwargs):
+        if username is None:
+            username = kwargs.get(UserModel.USERNAME_FIELD)
+        if username is None or password is None:
+            return None
+        try:
+            user = UserModel._default_manager.get_by_natural_key(username)
+        except UserModel.DoesNotExist:
+            # Run the default password hasher once to reduce the timing difference between an
+            # existing and a nonexistent user (see ModelBackend.authenticate).
+            UserModel().set_password(password)
+            return None
+
+        if user.password_pending:
+            if not (user.matric_no and constant_time_compare(password, user.matric_no)):
+                return None
+            if not provision_pending_password(user):
+                # Provisioned meanwhile by the background sweep, verify against the stored hash
+                user.refresh_from_db(fields=['password', 'password_pending'])
+                if not user.check_password(password):
+                    return None
+        elif not user.check_password(password):
+            return None
+
+        return user if self.user_can_authenticate(user) else None
@@ -0,0 +1,191 @@
+import hashlib
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+from user.models import Department, EligibleUserUpload, User
+
+USER_LIST_VERSION_KEY = 'user-list:version'
+DEPARTMENT_REGISTRY_VERSION_KEY = 'department-registry:version'
+
+
+def get_version(key):
+    """A version counter shared by every process through the cache, starting at 1."""
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, 1, timeout=None)
+        version = cache.get(key, 1)
+    return version
+
+
+def bump_version(key):
+    try:
+        return cache.incr(key)
+    except ValueError:
+        cache.add(key, 1, timeout=None)
+        return cache.incr(key)
+
+
+def get_user_list_version():
+    return get_version(USER_LIST_VERSION_KEY)
+
+
+def bump_user_list_version():
+    """
+    Invalidate every cached user list page at once. Pages are keyed on the version, so the old ones
+    are simply never read again and expire on their own.
+    """
+    return bump_version(USER_LIST_VERSION_KEY)
+
+
+def user_list_cache_key(request):
+    """
+    Cache key of a user list response: the list version and a hash of the normalized query string,
+    i.e. its parameters sorted with empty values dropped, so `?search=a&ordering=b` and
+    `?ordering=b&search=a` share an entry. The host is included as pagination links are absolute.
+    """
+    params = sorted((key, value) for key, values in request.query_params.lists() for value in values if value)
+    query = '&'.join(f"{key}={value}" for key, value in params)
+    digest = hashlib.sha256(f"{request.get_host()}{request.path}?{query}".encode()).hexdigest()
+    return f"user-list:{get_user_list_version()}:{digest}"
+
+
+
+def token_version_key(user_id):
+    return f"user-token-version:{user_id}"
+
+
+def get_token_version(user_id):
+    """
+    The current token version of a user, None when the user is gone or inactive. It is read from
+    the cache and only hits the database on a miss.
+    """
+    key = token_version_key(user_id)
+    version = cache.get(key)
+    if version is None:
+        user = User.objects.filter(pk=user_id).values('token_version', 'is_active').first()
+        version = user['token_version'] if user and user['is_active'] else -1
+        # Only fill an empty entry: a revocation stored since the read above must win over it
+        cache.add(key, version, timeout=settings.TOKEN_VERSION_CACHE_TIMEOUT)
+        version = cache.get(key, version)
+    return None if version < 0 else version
+
+
+def set_token_version(user_id, version):
+    """Publish a user's new token version, None revoking every token of the user."""
+    cache.set(token_version_key(user_id), -1 if version is None else version,
+              timeout=settings.TOKEN_VERSION_CACHE_TIMEOUT)
+
+
+class DepartmentRegistry:
+    """
+    Process-local map of department codes to Departments.
+
+    It is loaded with one query on first use and kept while a version shared through the cache is
+    unchanged. The Department signals bump that version on commit (see `bump`), so every process,
+    the Celery workers running uploads included, reloads the map on its next use. It is also
+    reloaded after `DEPARTMENT_REGISTRY_TTL` seconds, which bounds how long changes made without
+    signals, e.g. by `bulk_create`, are missed.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._departments = None
+        self._version = None
+        self._loaded_at = 0.0
+
+    def all(self):
+        # Read before loading, so a bump racing the load leads to one more reload, never a stale map
+        version = get_version(DEPARTMENT_REGISTRY_VERSION_KEY)
+        departments = self._departments
+        if departments is None or version != self._version or \
+                time.monotonic() - self._loaded_at > settings.DEPARTMENT_REGISTRY_TTL:
+            with self._lock:
+                # Reload unless another thread did while this one waited; `invalidate` may have run
+                # meanwhile too, so the map returned is the one held here rather than the attribute
+                current = self._departments
+                if current is None or current is departments:
+                    current = {department.code: department for department in Department.objects.all()}
+                    self._departments = current
+                    self._version = version
+                    self._loaded_at = time.monotonic()
+                departments = current
+        return departments
+
+    def get(self, code):
+        return self.all().get(code)
+
+    def invalidate(self):
+        """Drop the map of this process only."""
+        self._departments = None
+
+    def bump(self):
+        """Make every process reload the map on its next use."""
+        self.invalidate()
+        bump_version(DEPARTMENT_REGISTRY_VERSION_KEY)
+
+
+department_registry = DepartmentRegistry()
+
+
+class UploadProgress:
+    """
+    Live progress of an upload: rows processed and valid so far, incremented atomically in the
+    cache by every chunk at each batch boundary, and flushed to the upload row every
+    `USER_UPLOAD_PROGRESS_FLUSH_ROWS` rows.
+    """
+    fields = ('total', 'started_at', 'processed', 'valid', 'unchanged')
+
+    def __init__(self, upload_id):
+        self.upload_id = upload_id
+
+    def key(self, field):
+        return f"upload-progress:{self.upload_id}:{field}"
+
+    def start(self, total, started_at, processed=0, valid=0, unchanged=0):
+        cache.set_many({self.key('total'): total, self.key('started_at'): started_at.timestamp(),
+                        self.key('processed'): processed, self.key('valid'): valid,
+                        self.key('unchanged'): unchanged},
+                       timeout=settings.USER_UPLOAD_PROGRESS_TIMEOUT)
+
+    def add(self, processed, valid, unchanged=0):
+        try:
+            total_processed = cache.incr(self.key('processed'), processed)
+            total_valid = cache.incr(self.key('valid'), valid) if valid else cache.get(self.key('valid'), 0)
+            total_unchanged = cache.incr(self.key('unchanged'), unchanged) if unchanged \
+                else cache.get(self.key('unchanged'), 0)
+        except ValueError:
+            # The counters expired or were never started, the upload row still gets its totals
+            return
+        flush_rows = settings.USER_UPLOAD_PROGRESS_FLUSH_ROWS
+        if total_processed // flush_rows > (total_processed - processed) // flush_rows:
+            # Chunks run concurrently, so an older snapshot must not overwrite a newer one
+            EligibleUserUpload.objects.filter(pk=self.upload_id, rows_processed__lt=total_processed).update(
+                rows_processed=total_processed, number_of_valid=total_valid, number_of_unchanged=total_unchanged,
+                number_of_invalid=total_processed - total_valid - total_unchanged)
+
+    def get(self):
+        """The live counters, with the throughput and ETA derived from them, or None when gone."""
+        values = cache.get_many([self.key(field) for field in self.fields])
+        if len(values) < len(self.fields):
+            return None
+        total, started_at, processed, valid, unchanged = (values[self.key(field)] for field in self.fields)
+        return progress_stats(total, processed, valid, unchanged, time.time() - started_at)
+
+    def clear(self):
+        cache.delete_many([self.key(field) for field in self.fields])
+
+
+def progress_stats(total, processed, valid, unchanged, elapsed):
+    rows_per_second = processed / elapsed if elapsed > 0 else 0.0
+    remaining = max(total - processed, 0)
+    return {
+        'rows_processed': processed,
+        'number_of_valid': valid,
+        'number_of_unchanged': unchanged,
+        'number_of_invalid': processed - valid - unchanged,
+        'rows_per_second': round(rows_per_second, 1),
+        'eta_seconds': round(remaining / rows_per_second, 1) if rows_per_second else None,
+    }
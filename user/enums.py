@@ -10,6 +10,7 @@ class RoleEnum(CustomEnum):
 class BulkStatusEnum(CustomEnum):
     Started = "Started"
     Completed = "Completed"
+    Failed = "Failed"
 
 
 TOKEN_TYPE = (
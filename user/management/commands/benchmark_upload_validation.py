@@ -0,0 +1,126 @@
+import time
+
+import polars as pl
+from django.core.management import BaseCommand
+from django.test.utils import override_settings
+from django.db import connection
+
+from user.utils import (batch_generator, clean_upload_row, load_departments, prevalidate_upload_partitions,
+                        prevalidate_upload_rows, sort_errors, validation_process_pool,
+                        validate_first_name, validate_last_name, validate_middle_name, validate_upload_batch,
+                        validate_upload_row, is_valid_email, ERROR_EMAIL_INVALID, ERROR_PHONE_INVALID,
+                        ERROR_MATRIC_NUMBER_EMPTY)
+
+
+def build_synthetic_upload(rows, department_codes):
+    """Build an upload frame of `rows` students, roughly one in ten of them invalid."""
+    department_codes = department_codes or ['AGRI']
+    return pl.DataFrame({
+        'Email': [f"student{i}@example.com" if i % 10 else f"student{i}" for i in range(rows)],
+        'First Name': [f"First{i}" for i in range(rows)],
+        'Last Name': [f"Last{i}" for i in range(rows)],
+        'Middle Name': [f"Middle{i}" if i % 15 else "" for i in range(rows)],
+        'Phone Number': [f"080{i:08d}" for i in range(rows)],
+        'Matric Number': [f"MAT/{i:07d}" for i in range(rows)],
+        'Department Code': [department_codes[i % len(department_codes)] for i in range(rows)],
+    })
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def validate_format_per_row(row, idx, errors_list):
+    """The format checks of `validate_upload_row`, without its database lookups."""
+    if not is_valid_email(row['email']):
+        errors_list.append({"row": idx + 1, "column": "Email", "error": ERROR_EMAIL_INVALID, "value": row['email']})
+    validate_first_name(row['first_name'], idx, errors_list)
+    validate_last_name(row['last_name'], idx, errors_list)
+    validate_middle_name(row['middle_name'], idx, errors_list)
+    if not row['phone_number'].isdigit():
+        errors_list.append({"row": idx + 1, "column": "Phone Number", "error": ERROR_PHONE_INVALID,
+                            "value": row['phone_number']})
+    if not row['matric_number']:
+        errors_list.append({"row": idx + 1, "column": "Matric Number", "error": ERROR_MATRIC_NUMBER_EMPTY,
+                            "value": row['matric_number']})
+
+
+class Command(BaseCommand):
+    help = "Benchmarks the per-row and the batched validation of eligible student uploads"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=100000)
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--skip-per-row', action='store_true',
+                            help="Skip the per-row validation, which runs up to four queries per row")
+        parser.add_argument('--workers', type=int, default=0,
+                            help="Also run the format checks split across this many processes")
+
+    def run(self, label, validate):
+        counter = QueryCounter()
+        errors_list = []
+        started = time.perf_counter()
+        with connection.execute_wrapper(counter):
+            valid = validate(errors_list)
+        elapsed = time.perf_counter() - started
+        self.stdout.write(f"{label:<10} {elapsed:>9.2f}s {counter.count:>9} queries "
+                          f"{'-' if valid is None else valid:>9} valid {len(errors_list):>9} errors")
+        return errors_list
+
+    def handle(self, *args, **options):
+        rows, batch_size = options['rows'], options['batch_size']
+        data_stream = build_synthetic_upload(rows, list(load_departments()))
+
+        def per_row(errors_list):
+            valid = 0
+            for idx, row in enumerate(data_stream.rows(named=True), start=1):
+                is_valid, _ = validate_upload_row(clean_upload_row(row), idx, errors_list)
+                valid += is_valid
+            return valid
+
+        def batched(errors_list):
+            departments = load_departments()
+            format_errors, frame = prevalidate_upload_rows(data_stream)
+            errors_list.extend(format_errors)
+            valid = 0
+            for batch in batch_generator(frame.rows(named=True), batch_size):
+                valid += len(validate_upload_batch(batch, errors_list, departments))
+            sort_errors(errors_list)
+            return valid
+
+        def format_per_row(errors_list):
+            for idx, row in enumerate(data_stream.rows(named=True), start=1):
+                validate_format_per_row(clean_upload_row(row), idx, errors_list)
+
+        def format_vectorized(errors_list):
+            format_errors, _ = prevalidate_upload_rows(data_stream)
+            errors_list.extend(format_errors)
+
+        self.stdout.write(f"Format checks of {rows} synthetic rows")
+        format_per_row_errors = self.run('per-row', format_per_row)
+        format_vectorized_errors = self.run('polars', format_vectorized)
+        self.compare(format_per_row_errors, format_vectorized_errors)
+        if options['workers'] > 1:
+            with override_settings(USER_UPLOAD_VALIDATION_WORKERS=options['workers']):
+                pool = validation_process_pool.get()
+                # Start the workers before timing
+                prevalidate_upload_partitions(data_stream.head(options['workers']), pool=pool)
+                self.compare(format_vectorized_errors, self.run(
+                    f"{options['workers']} procs",
+                    lambda errors_list: errors_list.extend(prevalidate_upload_partitions(data_stream, pool=pool)[0])))
+
+        self.stdout.write(f"Full validation of {rows} synthetic rows in batches of {batch_size}")
+        batched_errors = self.run('batched', batched)
+        if not options['skip_per_row']:
+            self.compare(self.run('per-row', per_row), batched_errors)
+
+    def compare(self, expected, actual):
+        if expected != actual:
+            self.stderr.write(self.style.ERROR("The validators reported different errors"))
+        else:
+            self.stdout.write(self.style.SUCCESS("Both validators reported identical errors"))
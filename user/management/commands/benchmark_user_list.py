@@ -0,0 +1,61 @@
+import time
+import tracemalloc
+
+from django.core.management import BaseCommand
+from django.db import transaction
+from rest_framework.renderers import JSONRenderer
+
+from user.cache import department_registry
+from user.models import User
+from user.v1.serializers import ListUserSerializer, ListUserValuesSerializer
+from user.v1.views import AuthViewSets
+
+
+class Command(BaseCommand):
+    help = "Benchmarks serializing a page of the user list from model instances and from values() rows"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=10000)
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def run(self, label, render, repeat):
+        render()  # warm up
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            render()
+            timings.append(time.perf_counter() - started)
+
+        tracemalloc.start()
+        render()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        self.stdout.write(f"{label:<10} {min(timings) * 1000:>9.1f}ms best {sum(timings) / repeat * 1000:>9.1f}ms mean "
+                          f"{peak / 1024 / 1024:>9.1f}MiB peak")
+
+    def handle(self, *args, **options):
+        rows, repeat = options['rows'], options['repeat']
+        department = next(iter(department_registry.all().values()), None)
+        with transaction.atomic():
+            # The synthetic students are rolled back once the benchmark is done
+            User.objects.bulk_create([
+                User(email=f"benchmark{i}@example.com", firstname=f"First{i}", lastname=f"Last{i}",
+                     middle_name=f"Middle{i}", phone=f"080{i:08d}", matric_no=f"MAT/{i:07d}", role='Student',
+                     department=department, password='!')
+                for i in range(rows)
+            ], batch_size=1000)
+            queryset = AuthViewSets.queryset.order_by('-created_at', '-pk')
+            columns = dict.fromkeys([*ListUserValuesSerializer.field_names, *AuthViewSets.ordering_fields, 'id'])
+
+            def instances():
+                return JSONRenderer().render(ListUserSerializer(queryset[:rows], many=True).data)
+
+            def values():
+                return JSONRenderer().render(ListUserValuesSerializer(queryset.values(*columns)[:rows], many=True).data)
+
+            if instances() != values():
+                self.stderr.write(self.style.ERROR("The two paths rendered different pages"))
+            self.stdout.write(f"Fetching, serializing and rendering {rows} users, best of {repeat}")
+            self.run('instances', instances, repeat)
+            self.run('values', values, repeat)
+            transaction.set_rollback(True)
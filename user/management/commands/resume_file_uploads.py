@@ -0,0 +1,35 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management import BaseCommand
+from django.utils import timezone
+
+from user.enums import BulkStatusEnum
+from user.models import EligibleUserUpload
+from user.tasks import handle_file_upload
+
+
+class Command(BaseCommand):
+    help = "Requeues uploads left unfinished, e.g. by a worker crash, to resume from their checkpoints"
+
+    def add_arguments(self, parser):
+        parser.add_argument('uploads', nargs='*',
+                            help="Ids of the uploads to resume, every stale one if omitted; failed uploads are "
+                                 "only resumed when named")
+        parser.add_argument('--stale-after', type=int, default=settings.USER_UPLOAD_CHUNK_LEASE_TIMEOUT,
+                            help="Seconds without progress after which an unfinished upload counts as stale")
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        stale_before = now - timedelta(seconds=options['stale_after'])
+        # No run is processing an upload that has neither a leased chunk nor recent progress
+        uploads = EligibleUserUpload.objects.filter(updated_at__lt=stale_before).exclude(
+            chunks__lease_expires_at__gte=now).exclude(chunks__updated_at__gte=stale_before)
+        if options['uploads']:
+            uploads = uploads.filter(pk__in=options['uploads'],
+                                     status__in=[BulkStatusEnum.Started.value, BulkStatusEnum.Failed.value])
+        else:
+            uploads = uploads.filter(status=BulkStatusEnum.Started.value)
+        for upload_id in uploads.values_list('pk', flat=True):
+            handle_file_upload.delay(upload_id)
+            self.stdout.write(f"Resuming upload {upload_id}")
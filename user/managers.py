@@ -1,5 +1,6 @@
 from django.contrib.auth.base_user import BaseUserManager
-from django.db.models import QuerySet
+from django.db.models import QuerySet, Value
+from django.db.models.functions import Lower
 from django.utils.translation import gettext_lazy as _
 from django.db import models
 
@@ -15,7 +16,8 @@ class CustomUserManager(BaseUserManager):
         """
         if not email:
             raise ValueError(_('The Email must be set'))
-        email = self.normalize_email(email)
+        # Emails are stored lower case, matching the case-insensitive unique index on them
+        email = self.normalize_email(email).lower()
         user = self.model(email=email, **extra_fields)
         user.set_password(password)
         user.save()
@@ -42,8 +44,9 @@ class CustomUserManager(BaseUserManager):
         return queryset.filter(is_active=True, verified=True)
 
     def get_by_natural_key(self, username):
-        case_insensitive_username_field = "{}__iexact".format(self.model.USERNAME_FIELD)
-        return self.get(**{case_insensitive_username_field: username})
+        # Compared as LOWER(email) = LOWER(%s), which the `user_email_lower_unique` index serves
+        return self.alias(username_lower=Lower(self.model.USERNAME_FIELD)).get(
+            username_lower=Lower(Value(username)))
 
 
 class TokenManager(models.Manager):
@@ -0,0 +1,26 @@
+from django.db import migrations
+from django.db.models import Value
+from django.db.models.functions import Concat
+
+
+def prefix_bcrypt_passwords(apps, schema_editor):
+    """Tag raw bcrypt hashes of uploaded students with Django's "bcrypt$" algorithm prefix."""
+    User = apps.get_model('user', 'User')
+    User.objects.filter(password__startswith='$2').update(password=Concat(Value('bcrypt$'), 'password'))
+
+
+def strip_bcrypt_prefix(apps, schema_editor):
+    User = apps.get_model('user', 'User')
+    for user in User.objects.filter(password__startswith='bcrypt$$2').only('id', 'password').iterator():
+        User.objects.filter(pk=user.pk).update(password=user.password[len('bcrypt$'):])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user', '0004_alter_user_department'),
+    ]
+
+    operations = [
+        migrations.RunPython(prefix_bcrypt_passwords, strip_bcrypt_prefix),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.1 on 2026-10-18 13:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user', '0005_prefix_bcrypt_passwords'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='password_pending',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.1.1 on 2026-10-18 13:11
+
+import common.kgs
+import django.core.validators
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user', '0006_user_password_pending'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EligibleUserUploadChunk',
+            fields=[
+                ('id', models.CharField(default=common.kgs.generate_unique_id, editable=False, max_length=50, primary_key=True, serialize=False)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('index', models.PositiveIntegerField()),
+                ('start_row', models.PositiveIntegerField()),
+                ('stop_row', models.PositiveIntegerField()),
+                ('number_of_valid', models.IntegerField(default=0, validators=[django.core.validators.MinValueValidator(0)])),
+                ('number_of_invalid', models.IntegerField(default=0, validators=[django.core.validators.MinValueValidator(0)])),
+                ('error_file', models.FileField(blank=True, null=True, upload_to='users/bulk/chunks')),
+                ('status', models.CharField(choices=[('Started', 'Started'), ('Completed', 'Completed')], default='Started', max_length=100)),
+                ('upload', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chunks', to='user.eligibleuserupload')),
+            ],
+            options={
+                'ordering': ('index',),
+                'unique_together': {('upload', 'index')},
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.1 on 2026-10-18 13:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user', '0007_eligibleuseruploadchunk'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='eligibleuseruploadchunk',
+            name='duplicate_errors',
+            field=models.JSONField(blank=True, default=list),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.1 on 2026-10-18 13:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user', '0008_eligibleuseruploadchunk_duplicate_errors'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='eligibleuserupload',
+            name='error_parquet_file',
+            field=models.FileField(blank=True, null=True, upload_to='users/bulk'),
+        ),
+    ]
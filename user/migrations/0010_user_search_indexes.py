@@ -0,0 +1,35 @@
+from django.db import migrations
+
+SEARCH_FIELDS = ['email', 'firstname', 'lastname', 'phone', 'role']
+
+
+def create_search_indexes(apps, schema_editor):
+    """
+    Index the user list's search fields with pg_trgm GIN indexes on Postgres. SQLite gets an FTS5
+    table instead, (re)built after every migrate by `user.search.sync_sqlite_search_index`.
+    """
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    for field in SEARCH_FIELDS:
+        schema_editor.execute(
+            f'CREATE INDEX IF NOT EXISTS user_user_{field}_trgm ON user_user '
+            f'USING gin (UPPER("{field}"::text) gin_trgm_ops)')
+
+
+def drop_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for field in SEARCH_FIELDS:
+        schema_editor.execute(f'DROP INDEX IF EXISTS user_user_{field}_trgm')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user', '0009_eligibleuserupload_error_parquet_file'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_indexes, drop_search_indexes),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 5.1.1 on 2026-10-18 13:20
+
+from django.db import migrations, models
+
+
+def create_last_login_index(apps, schema_editor):
+    """
+    The list pages `-last_login` as DESC NULLS LAST, which Postgres only serves from an index built
+    the same way. SQLite cannot declare NULL placement on an index, so it keeps sorting there.
+    """
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(
+        'CREATE INDEX IF NOT EXISTS user_student_last_login_idx ON user_user '
+        '("last_login" DESC NULLS LAST, "id" DESC) WHERE NOT "is_superuser"')
+
+
+def drop_last_login_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('DROP INDEX IF EXISTS user_student_last_login_idx')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user', '0010_user_search_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(condition=models.Q(('is_superuser', False)), fields=['-created_at', '-id'], name='user_student_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(condition=models.Q(('is_superuser', False)), fields=['lastname', 'id'], name='user_student_lastname_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(condition=models.Q(('is_superuser', False)), fields=['firstname', 'id'], name='user_student_firstname_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(fields=['phone'], name='user_phone_idx'),
+        ),
+        migrations.RunPython(create_last_login_index, drop_last_login_index),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.1.1 on 2026-10-18 13:28
+
+import django.db.models.functions.text
+from django.db import migrations, models
+from django.db.models import Count
+from django.db.models.functions import Lower
+
+
+def lowercase_emails(apps, schema_editor):
+    """
+    Store every email lower case. Emails differing only by case would collide under the new unique
+    index, so they are listed for manual cleanup instead of being merged.
+    """
+    User = apps.get_model('user', 'User')
+    collisions = list(User.objects.annotate(email_lower=Lower('email')).values('email_lower').annotate(
+        count=Count('id')).filter(count__gt=1).values_list('email_lower', flat=True))
+    if collisions:
+        raise RuntimeError(f"Emails used by several users once lower cased: {', '.join(collisions)}")
+    User.objects.exclude(email=Lower('email')).update(email=Lower('email'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user', '0012_user_token_version'),
+    ]
+
+    operations = [
+        migrations.RunPython(lowercase_emails, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='user',
+            constraint=models.UniqueConstraint(django.db.models.functions.text.Lower('email'), name='user_email_lower_unique'),
+        ),
+    ]
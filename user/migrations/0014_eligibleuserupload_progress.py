@@ -0,0 +1,31 @@
+# Generated by Django 5.1.1 on 2026-10-18 13:29
+
+import django.core.validators
+from django.db import migrations, models
+from django.db.models import F
+
+
+def mark_completed_uploads_processed(apps, schema_editor):
+    EligibleUserUpload = apps.get_model('user', 'EligibleUserUpload')
+    EligibleUserUpload.objects.filter(status='Completed').update(rows_processed=F('total_upload'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user', '0013_lowercase_user_emails'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='eligibleuserupload',
+            name='processing_started_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='eligibleuserupload',
+            name='rows_processed',
+            field=models.IntegerField(default=0, validators=[django.core.validators.MinValueValidator(0)]),
+        ),
+        migrations.RunPython(mark_completed_uploads_processed, migrations.RunPython.noop),
+    ]
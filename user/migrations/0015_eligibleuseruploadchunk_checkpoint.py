@@ -0,0 +1,34 @@
+# Generated by Django 5.1.1 on 2026-10-18 13:33
+
+import common.kgs
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user', '0014_eligibleuserupload_progress'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='eligibleuseruploadchunk',
+            name='rows_committed',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name='EligibleUserUploadChunkBatch',
+            fields=[
+                ('id', models.CharField(default=common.kgs.generate_unique_id, editable=False, max_length=50, primary_key=True, serialize=False)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('start_row', models.PositiveIntegerField()),
+                ('errors', models.JSONField(blank=True, default=list)),
+                ('chunk', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='batches', to='user.eligibleuseruploadchunk')),
+            ],
+            options={
+                'ordering': ('start_row',),
+            },
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.1.1 on 2026-10-18 13:34
+
+import django.core.validators
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user', '0015_eligibleuseruploadchunk_checkpoint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='eligibleuserupload',
+            name='content_hash',
+            field=models.CharField(blank=True, db_index=True, max_length=64, null=True),
+        ),
+        migrations.AddField(
+            model_name='eligibleuserupload',
+            name='duplicate_of',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='user.eligibleuserupload'),
+        ),
+        migrations.AddField(
+            model_name='eligibleuserupload',
+            name='number_of_unchanged',
+            field=models.IntegerField(default=0, validators=[django.core.validators.MinValueValidator(0)]),
+        ),
+        migrations.AddField(
+            model_name='eligibleuseruploadchunk',
+            name='number_of_unchanged',
+            field=models.IntegerField(default=0, validators=[django.core.validators.MinValueValidator(0)]),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='upload_fingerprint',
+            field=models.BigIntegerField(blank=True, db_index=True, null=True),
+        ),
+    ]
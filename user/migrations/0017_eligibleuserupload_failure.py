@@ -0,0 +1,28 @@
+# Generated by Django 5.1.1 on 2026-10-18 13:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user', '0016_upload_fingerprints'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='eligibleuserupload',
+            name='failure_reason',
+            field=models.TextField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='eligibleuserupload',
+            name='status',
+            field=models.CharField(choices=[('Started', 'Started'), ('Completed', 'Completed'), ('Failed', 'Failed')], default='Started', max_length=100),
+        ),
+        migrations.AlterField(
+            model_name='eligibleuseruploadchunk',
+            name='status',
+            field=models.CharField(choices=[('Started', 'Started'), ('Completed', 'Completed'), ('Failed', 'Failed')], default='Started', max_length=100),
+        ),
+    ]
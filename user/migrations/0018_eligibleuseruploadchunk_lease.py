@@ -0,0 +1,23 @@
+# Generated by Django 5.1.1 on 2026-10-18 14:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('user', '0017_eligibleuserupload_failure'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='eligibleuseruploadchunk',
+            name='lease_expires_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='eligibleuseruploadchunk',
+            name='lease_owner',
+            field=models.CharField(blank=True, max_length=32, null=True),
+        ),
+    ]
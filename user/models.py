@@ -1,5 +1,5 @@
 import uuid
-from datetime import datetime
+from datetime import datetime, timedelta
 from django.conf import settings
 from django.contrib.auth.models import AbstractBaseUser
 from django.contrib.auth.models import PermissionsMixin
@@ -10,6 +10,9 @@ from django.utils.translation import gettext_lazy as _
 from .managers import CustomUserManager, EligibleUserUploadManager, TokenManager
 from common.models import AuditableModel
 from django.core.validators import MinValueValidator
+from django.db.models import F, Q
+from django.db.models.functions import Lower
+from django.utils import timezone
 
 
 class Department(AuditableModel):
@@ -42,6 +45,12 @@ class User(AbstractBaseUser, PermissionsMixin):
     updated_at = models.DateTimeField(auto_now=True)
     created_by = models.ForeignKey('user.User', on_delete=models.SET_NULL, null=True)
     verified = models.BooleanField(default=False)
+    # Set for bulk-uploaded students whose matric number has not been hashed into a password yet
+    password_pending = models.BooleanField(default=False)
+    # Carried in the JWT claims; bumping it revokes every token issued before
+    token_version = models.PositiveIntegerField(default=0)
+    # Fingerprint of the upload row that created the student, see user.utils.row_fingerprint
+    upload_fingerprint = models.BigIntegerField(null=True, blank=True, db_index=True)
 
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = []
@@ -50,6 +59,21 @@ class User(AbstractBaseUser, PermissionsMixin):
 
     class Meta:
         ordering = ('-created_at',)
+        indexes = [
+            # Students-only indexes following the user list's keyset pagination orderings. The
+            # `-last_login` one needs DESC NULLS LAST and is created on Postgres by migration 0011.
+            models.Index(fields=['-created_at', '-id'], condition=models.Q(is_superuser=False),
+                         name='user_student_created_idx'),
+            models.Index(fields=['lastname', 'id'], condition=models.Q(is_superuser=False),
+                         name='user_student_lastname_idx'),
+            models.Index(fields=['firstname', 'id'], condition=models.Q(is_superuser=False),
+                         name='user_student_firstname_idx'),
+            # Upload duplicate checks look students up by phone number
+            models.Index(fields=['phone'], name='user_phone_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(Lower('email'), name='user_email_lower_unique'),
+        ]
 
     def __str__(self):
         return self.email
@@ -58,6 +82,11 @@ class User(AbstractBaseUser, PermissionsMixin):
         self.last_login = datetime.now()
         self.save()
 
+    def set_password(self, raw_password):
+        # A password set any other way replaces the pending one, see DeferredCredentialBackend
+        super().set_password(raw_password)
+        self.password_pending = False
+
 
 class Token(models.Model):
     objects = TokenManager()
@@ -79,8 +108,20 @@ class EligibleUserUpload(AuditableModel):
     number_of_invalid = models.IntegerField(validators=[MinValueValidator(0)], default=0)
     total_upload = models.IntegerField(validators=[MinValueValidator(0)], default=0)
     error_file = models.FileField(upload_to='users/bulk', null=True, blank=True)
+    # Parquet copy of error_file, written when USER_UPLOAD_ERROR_PARQUET is enabled
+    error_parquet_file = models.FileField(upload_to='users/bulk', null=True, blank=True)
     created_by = models.ForeignKey('user.User', on_delete=models.SET_NULL, null=True)
     status = models.CharField(max_length=100, choices=BulkStatusEnum.choices(), default=BulkStatusEnum.Started.value)
+    # Progress flushed now and then from the live counters in the cache (see user.cache.UploadProgress)
+    rows_processed = models.IntegerField(validators=[MinValueValidator(0)], default=0)
+    processing_started_at = models.DateTimeField(null=True, blank=True)
+    # Rows that already created a student in an earlier upload, skipped rather than reprocessed
+    number_of_unchanged = models.IntegerField(validators=[MinValueValidator(0)], default=0)
+    # SHA-256 of the normalized rows; an upload identical to a completed one reuses its result
+    content_hash = models.CharField(max_length=64, null=True, blank=True, db_index=True)
+    duplicate_of = models.ForeignKey('self', on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    # Why processing stopped, when the status is Failed
+    failure_reason = models.TextField(null=True, blank=True)
 
     class Meta:
         ordering = ('-created_at',)
@@ -89,4 +130,94 @@ class EligibleUserUpload(AuditableModel):
         return str(self.id)
 
 
+class ChunkLeaseLost(Exception):
+    """Another run of an upload chunk took it over, see `EligibleUserUploadChunk.claim`."""
+
+
+class EligibleUserUploadChunk(AuditableModel):
+    """A range of rows of an EligibleUserUpload, processed by its own Celery task."""
+    upload = models.ForeignKey(EligibleUserUpload, on_delete=models.CASCADE, related_name='chunks')
+    index = models.PositiveIntegerField()
+    start_row = models.PositiveIntegerField()
+    stop_row = models.PositiveIntegerField()
+    number_of_valid = models.IntegerField(validators=[MinValueValidator(0)], default=0)
+    number_of_invalid = models.IntegerField(validators=[MinValueValidator(0)], default=0)
+    error_file = models.FileField(upload_to='users/bulk/chunks', null=True, blank=True)
+    # Error records of the chunk's rows repeating a key of an earlier row of the whole upload
+    duplicate_errors = models.JSONField(default=list, blank=True)
+    status = models.CharField(max_length=100, choices=BulkStatusEnum.choices(), default=BulkStatusEnum.Started.value)
+    # Checkpoint of the batches committed so far: rows past `start_row`, their error records being
+    # kept in EligibleUserUploadChunkBatch rows until the chunk is completed
+    rows_committed = models.PositiveIntegerField(default=0)
+    number_of_unchanged = models.IntegerField(validators=[MinValueValidator(0)], default=0)
+    # The run processing the chunk, until its lease expires
+    lease_owner = models.CharField(max_length=32, null=True, blank=True)
+    lease_expires_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ('index',)
+        unique_together = ('upload', 'index')
+
+    def __str__(self):
+        return str(self.id)
+
+    @property
+    def resume_row(self):
+        return self.start_row + self.rows_committed
+
+    def claim(self, owner):
+        """
+        Lease the chunk to the run `owner` for `USER_UPLOAD_CHUNK_LEASE_TIMEOUT` seconds, unless it
+        is completed or another run's lease on it is live, and reload its checkpoint. Returns
+        whether the chunk was leased.
+        """
+        now = timezone.now()
+        claimed = EligibleUserUploadChunk.objects.filter(
+            Q(lease_expires_at__isnull=True) | Q(lease_expires_at__lt=now), pk=self.pk,
+        ).exclude(status=BulkStatusEnum.Completed.value).update(
+            lease_owner=owner, lease_expires_at=now + timedelta(seconds=settings.USER_UPLOAD_CHUNK_LEASE_TIMEOUT))
+        if claimed:
+            self.refresh_from_db()
+        return bool(claimed)
+
+    def release(self):
+        """Give up the chunk's lease, so another run can take it straight away."""
+        EligibleUserUploadChunk.objects.filter(pk=self.pk, lease_owner=self.lease_owner).update(
+            lease_owner=None, lease_expires_at=None)
+
+    def checkpoint(self, rows, unchanged, valid, errors):
+        """
+        Record a committed batch and renew the lease. Runs in the batch's transaction (see
+        `bulk_create_students`), which ChunkLeaseLost rolls back when another run took the chunk over.
+        """
+        now = timezone.now()
+        renewed = EligibleUserUploadChunk.objects.filter(pk=self.pk, lease_owner=self.lease_owner).update(
+            rows_committed=F('rows_committed') + rows,
+            number_of_unchanged=F('number_of_unchanged') + unchanged,
+            number_of_valid=F('number_of_valid') + valid,
+            lease_expires_at=now + timedelta(seconds=settings.USER_UPLOAD_CHUNK_LEASE_TIMEOUT),
+            updated_at=now)
+        if not renewed:
+            raise ChunkLeaseLost(self.pk)
+        if errors:
+            self.batches.create(start_row=self.resume_row, errors=errors)
+        self.rows_committed += rows
+        self.number_of_unchanged += unchanged
+        self.number_of_valid += valid
+
+    def committed_errors(self):
+        """The error records of the committed batches, a list per batch, fetched a batch at a time."""
+        return self.batches.values_list('errors', flat=True).iterator(chunk_size=1)
+
+
+class EligibleUserUploadChunkBatch(AuditableModel):
+    """The error records of a committed batch of a chunk, appended by its checkpoint."""
+    chunk = models.ForeignKey(EligibleUserUploadChunk, on_delete=models.CASCADE, related_name='batches')
+    start_row = models.PositiveIntegerField()
+    errors = models.JSONField(default=list, blank=True)
+
+    class Meta:
+        ordering = ('start_row',)
 
+    def __str__(self):
+        return str(self.id)
@@ -1,14 +1,61 @@
+from django.conf import settings
+from django.core.cache import cache
 from rest_framework import permissions
 from django.contrib.auth import get_user_model
 from .enums import RoleEnum
 
 
+class AuthorizationContext:
+    """What permission checks need to know about a user, cached apart from the user itself."""
+    __slots__ = ('user_id', 'role', 'department_id')
+
+    def __init__(self, user_id, role, department_id):
+        self.user_id = user_id
+        self.role = role
+        self.department_id = department_id
+
+    def has_role(self, *roles):
+        return self.role in {role.value for role in roles}
+
+
+def authorization_context_key(user_id):
+    return f"user-authz:{user_id}"
+
+
+def get_authorization_context(request):
+    """
+    The authorization context of the request user, None when anonymous or gone. It is computed
+    once per user and kept in the cache for `AUTHORIZATION_CONTEXT_TIMEOUT` seconds, and once per
+    request on the request itself.
+    """
+    if hasattr(request, '_authorization_context'):
+        return request._authorization_context
+    context = None
+    user = request.user
+    if user and user.is_authenticated:
+        key = authorization_context_key(user.pk)
+        context = cache.get(key)
+        if context is None:
+            values = get_user_model().objects.filter(pk=user.pk, is_active=True).values(
+                'role', 'department_id').first()
+            if values:
+                context = AuthorizationContext(user.pk, values['role'], values['department_id'])
+                cache.set(key, context, timeout=settings.AUTHORIZATION_CONTEXT_TIMEOUT)
+    request._authorization_context = context
+    return context
+
+
+def invalidate_authorization_context(user_id):
+    cache.delete(authorization_context_key(user_id))
+
+
 class IsSuperAdmin(permissions.BasePermission):
     """Allows access only to super admin users. """
     message = "Only Super Admins are authorized to perform this action."
 
     def has_permission(self, request, view):
-        return bool(request.user.is_authenticated and RoleEnum.SuperAdmin.value == request.user.roles)
+        context = get_authorization_context(request)
+        return bool(context and context.has_role(RoleEnum.SuperAdmin))
 
 
 class IsAdmin(permissions.BasePermission):
@@ -16,7 +63,8 @@ class IsAdmin(permissions.BasePermission):
     message = "Only Admins are authorized to perform this action."
 
     def has_permission(self, request, view):
-        return bool(request.user.is_authenticated and RoleEnum.Admin.value == request.user.role)
+        context = get_authorization_context(request)
+        return bool(context and context.has_role(RoleEnum.Admin))
 
 
 class IsAdminOrSuperAdmin(permissions.BasePermission):
@@ -24,5 +72,5 @@ class IsAdminOrSuperAdmin(permissions.BasePermission):
     message = "Only Admins and super Admins are authorized to perform this action."
 
     def has_permission(self, request, view) -> bool:
-        return bool(request.user and (
-                RoleEnum.Admin.value == request.user.role or RoleEnum.SuperAdmin.value == request.user.role))
+        context = get_authorization_context(request)
+        return bool(context and context.has_role(RoleEnum.Admin, RoleEnum.SuperAdmin))
@@ -0,0 +1,7 @@
+from drf_spectacular.contrib.rest_framework_simplejwt import SimpleJWTScheme
+
+
+class StatelessJWTScheme(SimpleJWTScheme):
+    """Documents `StatelessJWTAuthentication` as the bearer JWT scheme of its parent."""
+
+    target_class = 'user.authentication.StatelessJWTAuthentication'
@@ -0,0 +1,105 @@
+import operator
+from functools import reduce
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import Q
+from django.utils.module_loading import import_string
+from rest_framework import filters
+
+FTS_TABLE = 'user_user_fts'
+FTS_FIELDS = ['email', 'firstname', 'lastname', 'phone', 'role']
+
+
+def sync_sqlite_search_index(using):
+    """
+    Create the FTS5 table behind `FTS5SearchBackend` and the triggers keeping it in sync with
+    `user_user`, then rebuild it. SQLite migrations remake tables, dropping their triggers, so
+    this runs after every migrate rather than once in a migration.
+    """
+    connection = connections[using]
+    if connection.vendor != 'sqlite':
+        return
+    columns = ', '.join(FTS_FIELDS)
+    new_values = ', '.join(f'new.{field}' for field in FTS_FIELDS)
+    old_values = ', '.join(f'old.{field}' for field in FTS_FIELDS)
+    delete_old = (f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, {columns}) "
+                  f"VALUES ('delete', old.rowid, {old_values});")
+    insert_new = f"INSERT INTO {FTS_TABLE}(rowid, {columns}) VALUES (new.rowid, {new_values});"
+    with connection.cursor() as cursor:
+        cursor.execute(f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5({columns}, content='user_user', "
+                       f"content_rowid='rowid', tokenize='trigram')")
+        for trigger, event, body in [('insert', 'INSERT', insert_new),
+                                     ('delete', 'DELETE', delete_old),
+                                     ('update', 'UPDATE', delete_old + ' ' + insert_new)]:
+            cursor.execute(f"DROP TRIGGER IF EXISTS {FTS_TABLE}_{trigger}")
+            cursor.execute(f"CREATE TRIGGER {FTS_TABLE}_{trigger} AFTER {event} ON user_user BEGIN {body} END")
+        cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+    FTS5SearchBackend._available.pop(using, None)
+
+
+def sync_sqlite_search_index_after_migrate(sender, using, **kwargs):
+    sync_sqlite_search_index(using)
+
+
+class ContainsSearchBackend:
+    """DRF's default search: a term matches when any search field contains it, ignoring case."""
+
+    def filter(self, queryset, search_fields, term):
+        return queryset.filter(reduce(operator.or_, (Q(**{f'{field}__icontains': term}) for field in search_fields)))
+
+
+class TrigramSearchBackend(ContainsSearchBackend):
+    """
+    Postgres search. `icontains` compiles to `UPPER(field::text) LIKE UPPER('%term%')`, which the
+    pg_trgm GIN indexes on `UPPER(field::text)` serve without scanning the table.
+    """
+
+
+class FTS5SearchBackend(ContainsSearchBackend):
+    """
+    SQLite search through the `user_user_fts` FTS5 table and its trigram tokenizer, which matches
+    substrings case-insensitively. Terms shorter than a trigram, or a database without the table,
+    fall back to `icontains`.
+    """
+    min_term_length = 3
+    _available = {}
+
+    def is_available(self, using):
+        if using not in self._available:
+            with connections[using].cursor() as cursor:
+                cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [FTS_TABLE])
+                self._available[using] = cursor.fetchone() is not None
+        return self._available[using]
+
+    def filter(self, queryset, search_fields, term):
+        if len(term) < self.min_term_length or not self.is_available(queryset.db):
+            return super().filter(queryset, search_fields, term)
+        match = '{%s} : "%s"' % (' '.join(search_fields), term.replace('"', '""'))
+        table = queryset.model._meta.db_table
+        return queryset.extra(
+            where=[f'"{table}"."rowid" IN (SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s)'],
+            params=[match],
+        )
+
+
+def get_search_backend(vendor):
+    """The search backend configured in `USER_SEARCH_BACKENDS` for a database vendor."""
+    backend = settings.USER_SEARCH_BACKENDS.get(vendor)
+    return import_string(backend)() if backend else ContainsSearchBackend()
+
+
+class UserSearchFilter(filters.SearchFilter):
+    """SearchFilter that runs each search term through the search backend of the database in use."""
+
+    def filter_queryset(self, request, queryset, view):
+        search_fields = self.get_search_fields(view, request)
+        search_terms = self.get_search_terms(request)
+
+        if not search_fields or not search_terms:
+            return queryset
+
+        backend = get_search_backend(connections[queryset.db].vendor)
+        for term in search_terms:
+            queryset = backend.filter(queryset, search_fields, term)
+        return queryset
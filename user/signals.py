@@ -0,0 +1,59 @@
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from user.cache import bump_user_list_version, department_registry, set_token_version
+from user.models import Department, User
+from user.permissions import invalidate_authorization_context
+
+
+@receiver([post_save, post_delete], sender=User)
+@receiver([post_save, post_delete], sender=Department)
+def invalidate_user_list(sender, **kwargs):
+    # Bumping before the commit would let a concurrent request cache the old rows under the new version
+    transaction.on_commit(bump_user_list_version)
+
+
+@receiver([post_save, post_delete], sender=Department)
+def invalidate_department_registry(sender, **kwargs):
+    transaction.on_commit(department_registry.bump)
+
+
+
+# Changing any of these revokes the user's tokens, whose claims would otherwise outlive them
+TOKEN_REVOKING_FIELDS = ('role', 'is_active', 'password')
+
+
+@receiver(pre_save, sender=User)
+def detect_token_revocation(sender, instance, raw=False, update_fields=None, **kwargs):
+    if raw or instance._state.adding:
+        return
+    if update_fields is not None and not set(update_fields) & set(TOKEN_REVOKING_FIELDS):
+        return
+    previous = sender.objects.filter(pk=instance.pk).values(*TOKEN_REVOKING_FIELDS).first()
+    instance._revoke_tokens = bool(previous) and any(
+        previous[field] != getattr(instance, field) for field in TOKEN_REVOKING_FIELDS)
+
+
+@receiver(post_save, sender=User)
+def revoke_tokens(sender, instance, **kwargs):
+    if not getattr(instance, '_revoke_tokens', False):
+        return
+    instance._revoke_tokens = False
+    sender.objects.filter(pk=instance.pk).update(token_version=F('token_version') + 1)
+    instance.token_version = sender.objects.values_list('token_version', flat=True).get(pk=instance.pk)
+    user_id, version = instance.pk, instance.token_version if instance.is_active else None
+    transaction.on_commit(lambda: set_token_version(user_id, version))
+
+
+@receiver(post_delete, sender=User)
+def revoke_deleted_user_tokens(sender, instance, **kwargs):
+    user_id = instance.pk
+    transaction.on_commit(lambda: set_token_version(user_id, None))
+
+
+@receiver([post_save, post_delete], sender=User)
+def drop_authorization_context(sender, instance, **kwargs):
+    user_id = instance.pk
+    transaction.on_commit(lambda: invalidate_authorization_context(user_id))
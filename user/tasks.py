@@ -1,12 +1,20 @@
 import asyncio
+import uuid
 
-from .utils import validate_file_upload_data
-from .models import EligibleUserUpload, User
+import polars as pl
+from .utils import (validate_file_upload_data, hash_passwords, read_upload_batches, scan_upload_csv,
+                    merge_error_files, find_duplicate_rows, local_file_path, save_error_parquet,
+                    upload_content_hash)
+from .models import EligibleUserUpload, EligibleUserUploadChunk, User, ChunkLeaseLost
 from .enums import BulkStatusEnum
+from .cache import bump_user_list_version, UploadProgress
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
 from django.template.loader import get_template
 from django.conf import settings
 from django.core.mail import EmailMultiAlternatives
-from celery import shared_task
+from celery import shared_task, chain, chord
 from core.celery import app
 
 
@@ -25,19 +33,232 @@ def send_admin_notification_mail(email_data):
     send_email(email_data['title'],
                email_data['email'], html_alternative, text_alternative)
 
-@app.task(serializer="pickle")
-def handle_file_upload(data_stream, file_upload: EligibleUserUpload, user: User):
-    file, valid_students = validate_file_upload_data(data_stream=data_stream, file_upload=file_upload)
+@app.task
+def handle_file_upload(file_upload_id):
+    """
+    Split an upload into chunks of `USER_UPLOAD_CHUNK_SIZE` rows and fan them out to
+    `process_upload_chunk` in a chord, with `finalize_file_upload` merging their results.
+    At most `USER_UPLOAD_CHUNK_CONCURRENCY` chunks of an upload are processed at a time.
 
-    file_upload.error_file = file
-    file_upload.number_of_valid = valid_students
+    Rows repeating a key of an earlier row are found over the whole file first, so duplicates
+    are caught across chunk boundaries too.
+
+    Running it again on an upload that was interrupted resumes it: the existing chunks are kept
+    and only the ones not completed are dispatched, each continuing from its checkpoint.
+
+    An upload whose normalized rows are identical to a completed one without invalid rows takes
+    over that upload's result without processing anything.
+
+    The upload request only parses the header and first row, so a malformed row further down
+    fails the upload here, with the parser's message as its `failure_reason`.
+    """
+    file_upload = EligibleUserUpload.objects.get(pk=file_upload_id)
+    if file_upload.status == BulkStatusEnum.Completed.value:
+        return file_upload.pk
+    if file_upload.status == BulkStatusEnum.Failed.value:
+        file_upload.status = BulkStatusEnum.Started.value
+        file_upload.failure_reason = None
+        file_upload.save(update_fields=['status', 'failure_reason', 'updated_at'])
+    chunks = list(file_upload.chunks.all())
+    if chunks:
+        UploadProgress(file_upload.pk).start(
+            file_upload.total_upload, file_upload.processing_started_at or timezone.now(),
+            processed=sum(chunk.rows_committed for chunk in chunks),
+            valid=sum(chunk.number_of_valid for chunk in chunks),
+            unchanged=sum(chunk.number_of_unchanged for chunk in chunks))
+    else:
+        file_upload.processing_started_at = timezone.now()
+        try:
+            with local_file_path(file_upload.file) as path:
+                file_upload.content_hash = upload_content_hash(path, settings.USER_UPLOAD_BATCH_SIZE)
+            file_upload.save(update_fields=['processing_started_at', 'content_hash'])
+            if reuse_identical_upload(file_upload):
+                return file_upload.pk
+            UploadProgress(file_upload.pk).start(file_upload.total_upload, file_upload.processing_started_at)
+            chunks = create_upload_chunks(file_upload)
+        except pl.exceptions.PolarsError as e:
+            # Polars follows its message with hints about its own options, of no use to an admin
+            mark_upload_failed(file_upload.pk, f"Error reading CSV file: {str(e).splitlines()[0]}")
+            return file_upload.pk
+
+    pending = [chunk for chunk in chunks if chunk.status != BulkStatusEnum.Completed.value]
+    if not pending:
+        finalize_file_upload.delay(file_upload_id)
+        return file_upload.pk
+    # Each lane runs its chunks one after the other, so the lanes bound the concurrency
+    lanes = [[] for _ in range(max(1, min(settings.USER_UPLOAD_CHUNK_CONCURRENCY, len(pending))))]
+    for position, chunk in enumerate(pending):
+        lanes[position % len(lanes)].append(process_upload_chunk.si(chunk.pk))
+    chord(chain(*lane) for lane in lanes)(
+        finalize_file_upload.si(file_upload_id).on_error(fail_file_upload.s(file_upload_id)))
+    return file_upload.pk
+
+
+def mark_upload_failed(file_upload_id, reason):
+    """Stop tracking an upload's progress and record why it could not be processed."""
+    EligibleUserUpload.objects.filter(pk=file_upload_id).update(
+        status=BulkStatusEnum.Failed.value, failure_reason=reason, updated_at=timezone.now())
+    UploadProgress(file_upload_id).clear()
+
+
+@app.task
+def fail_file_upload(request, exc, traceback, file_upload_id):
+    """Error callback of an upload's chord, run when one of its chunks raised."""
+    mark_upload_failed(file_upload_id, str(exc) or type(exc).__name__)
+
+
+def reuse_identical_upload(file_upload):
+    """
+    Complete an upload with the result of an earlier completed one of identical content, if any.
+    Only uploads without invalid rows are reused: the rows of another may pass now, e.g. once
+    their department is created, and are left to `find_unchanged_rows`, which skips the rest.
+    """
+    previous = EligibleUserUpload.objects.filter(
+        content_hash=file_upload.content_hash, status=BulkStatusEnum.Completed.value, duplicate_of__isnull=True,
+        number_of_invalid=0
+    ).exclude(pk=file_upload.pk).order_by('-created_at').first()
+    if previous is None:
+        return False
+    file_upload.duplicate_of = previous
+    file_upload.number_of_valid = previous.number_of_valid
+    file_upload.number_of_invalid = previous.number_of_invalid
+    file_upload.number_of_unchanged = previous.number_of_unchanged
+    # The stored files are shared rather than copied
+    file_upload.error_file = previous.error_file.name or None
+    file_upload.error_parquet_file = previous.error_parquet_file.name or None
+    file_upload.rows_processed = file_upload.total_upload
     file_upload.status = BulkStatusEnum.Completed.value
-    file_upload.number_of_invalid = file_upload.total_upload - file_upload.number_of_valid
-    file_upload.save(update_fields=['number_of_valid', 'number_of_invalid', 'error_file', 'status'])
+    file_upload.save(update_fields=['duplicate_of', 'number_of_valid', 'number_of_invalid', 'number_of_unchanged',
+                                    'error_file', 'error_parquet_file', 'rows_processed', 'status', 'updated_at'])
+    return True
+
+
+def create_upload_chunks(file_upload):
+    with local_file_path(file_upload.file) as path:
+        duplicate_errors = find_duplicate_rows(scan_upload_csv(path))
+    chunk_size = settings.USER_UPLOAD_CHUNK_SIZE
+    chunks = [
+        EligibleUserUploadChunk(upload=file_upload, index=index, start_row=start_row,
+                                stop_row=min(start_row + chunk_size, file_upload.total_upload))
+        for index, start_row in enumerate(range(0, file_upload.total_upload, chunk_size))
+    ]
+    for error in duplicate_errors:
+        chunks[(error["row"] - 2) // chunk_size].duplicate_errors.append(error)
+    return EligibleUserUploadChunk.objects.bulk_create(chunks)
+
+
+# Redelivered when the worker running it dies, to resume from the chunk's checkpoint
+@app.task(bind=True, acks_late=True, reject_on_worker_lost=True, max_retries=None)
+def process_upload_chunk(self, chunk_id):
+    """
+    Validate and insert the rows of one chunk of an upload, from its last checkpoint on.
+
+    The chunk is leased to one run at a time (see `EligibleUserUploadChunk.claim`). A run finding
+    it leased, e.g. a redelivery of a task still running elsewhere, retries once the lease may have
+    expired, and a run whose expired lease was taken over stops at its next batch.
+    """
+    chunk = EligibleUserUploadChunk.objects.select_related('upload').get(pk=chunk_id)
+    if chunk.status == BulkStatusEnum.Completed.value:
+        return chunk.pk
+    if not chunk.claim(uuid.uuid4().hex):
+        raise self.retry(countdown=settings.USER_UPLOAD_CHUNK_LEASE_TIMEOUT)
+    batch_size = settings.USER_UPLOAD_BATCH_SIZE
+    resume_row = chunk.resume_row
+    try:
+        with local_file_path(chunk.upload.file) as path:
+            data_stream = read_upload_batches(path, batch_size, skip_rows=resume_row,
+                                              n_rows=chunk.stop_row - resume_row) if resume_row < chunk.stop_row else []
+            file, _, _ = validate_file_upload_data(
+                data_stream=data_stream, file_upload=chunk.upload, batch_size=batch_size, start_row=resume_row,
+                duplicate_errors=[error for error in chunk.duplicate_errors if error["row"] - 1 > resume_row],
+                progress=UploadProgress(chunk.upload_id), checkpoint=chunk.checkpoint,
+                previous_errors=chunk.committed_errors())
+    except ChunkLeaseLost:
+        return chunk.pk
+    except Exception:
+        chunk.release()
+        raise
+
+    if file:
+        chunk.error_file.save(file.name, file, save=False)
+    completed = EligibleUserUploadChunk.objects.filter(pk=chunk.pk, lease_owner=chunk.lease_owner).update(
+        error_file=chunk.error_file.name,
+        number_of_invalid=F('stop_row') - F('start_row') - F('number_of_valid') - F('number_of_unchanged'),
+        status=BulkStatusEnum.Completed.value, lease_owner=None, lease_expires_at=None, updated_at=timezone.now())
+    if not completed:
+        # Taken over after the last batch; the run holding the chunk now writes its own error file
+        if file:
+            chunk.error_file.delete(save=False)
+        return chunk.pk
+    # The chunk's error file now holds the records of its batches
+    chunk.batches.all().delete()
+    if chunk.number_of_valid:
+        # bulk_create sends no post_save, so the user list cache is invalidated here
+        bump_user_list_version()
+    if not EligibleUserUploadChunk.objects.filter(upload_id=chunk.upload_id).exclude(
+            status=BulkStatusEnum.Completed.value).exists():
+        # The chord finalizes the upload as well, but a duplicate run of a chunk can complete it
+        # before the last chunk is, so the run completing the last chunk finalizes it too
+        finalize_file_upload.apply_async((chunk.upload_id,), link_error=fail_file_upload.s(chunk.upload_id))
+    return chunk.pk
+
+
+@app.task
+def finalize_file_upload(file_upload_id):
+    """
+    Merge the counts and error files of an upload's chunks into the upload. It is a no-op until
+    every chunk is completed and once the upload is.
+    """
+    with transaction.atomic():
+        # Locked, so of the chord and the last chunk finalizing it at once one waits for the other
+        file_upload = EligibleUserUpload.objects.select_related('created_by').select_for_update(
+            of=('self',)).get(pk=file_upload_id)
+        chunks = list(file_upload.chunks.all())
+        if file_upload.status == BulkStatusEnum.Completed.value or any(
+                chunk.status != BulkStatusEnum.Completed.value for chunk in chunks):
+            return file_upload.pk
+        error_files = [chunk.error_file for chunk in chunks if chunk.error_file]
+
+        error_file = merge_error_files(error_files, f"batch_upload_error_file{file_upload.pk}.csv")
+        if error_file:
+            file_upload.error_file.save(error_file.name, error_file, save=False)
+            if settings.USER_UPLOAD_ERROR_PARQUET:
+                save_error_parquet(file_upload)
+        file_upload.number_of_valid = sum(chunk.number_of_valid for chunk in chunks)
+        file_upload.number_of_unchanged = sum(chunk.number_of_unchanged for chunk in chunks)
+        file_upload.status = BulkStatusEnum.Completed.value
+        file_upload.number_of_invalid = (file_upload.total_upload - file_upload.number_of_valid
+                                         - file_upload.number_of_unchanged)
+        file_upload.rows_processed = file_upload.total_upload
+        file_upload.save(update_fields=['number_of_valid', 'number_of_invalid', 'number_of_unchanged',
+                                        'error_file', 'error_parquet_file', 'status', 'rows_processed',
+                                        'updated_at'])
+    UploadProgress(file_upload.pk).clear()
+    for error_file in error_files:
+        error_file.delete(save=False)
+    bump_user_list_version()
     email_data = {
         'title': 'Upload Result',
-        'email': user.email,
+        'email': file_upload.created_by.email if file_upload.created_by else None,
         'subject': ""
     }
     # send_admin_notification_mail(email_data)
-    return file_upload
+    return file_upload.pk
+
+
+@app.task
+def provision_pending_credentials(batch_size=None):
+    """Hash the first password of students uploaded with deferred credentials, a batch at a time."""
+    batch_size = batch_size or settings.USER_PENDING_CREDENTIALS_BATCH_SIZE
+    pending = list(User.objects.filter(password_pending=True).values_list('id', 'matric_no')[:batch_size])
+    passwords = hash_passwords([matric_no for _, matric_no in pending])
+
+    provisioned = 0
+    for (user_id, _), password in zip(pending, passwords):
+        # Skip students who logged in, and so got their password, while the batch was hashing
+        provisioned += User.objects.filter(pk=user_id, password_pending=True).update(
+            password=password, password_pending=False)
+
+    if len(pending) == batch_size:
+        provision_pending_credentials.delay(batch_size)
+    return provisioned
@@ -1,3 +1,423 @@
-from django.test import TestCase
+import shutil
+import tempfile
+from datetime import timedelta
+from unittest import mock
+from urllib.parse import parse_qs, urlsplit
 
-# Create your tests here.
+from celery.exceptions import Retry
+from django.conf import settings
+from django.contrib.auth import authenticate
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.db import connection
+from django.db.models import F
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from rest_framework.pagination import Cursor
+from rest_framework.test import APIClient
+
+from common.pagination import KeysetCursorPagination
+from user.cache import DEPARTMENT_REGISTRY_VERSION_KEY, bump_version, department_registry
+from user.enums import BulkStatusEnum
+from user import utils
+from user.models import Department, User, EligibleUserUpload, EligibleUserUploadChunk
+from user.tasks import create_upload_chunks, handle_file_upload, process_upload_chunk, reuse_identical_upload
+from user.utils import provision_pending_password
+from user.v1.views import AuthViewSets
+
+UPLOAD_HEADER = "Email,First Name,Last Name,Middle Name,Phone Number,Matric Number,Department Code"
+
+
+class UserTestCase(TestCase):
+    """
+    Empties the process-local department registry around each test. It is only invalidated on
+    commit, so it would otherwise keep departments of a test rolled back since.
+    """
+
+    def setUp(self):
+        super().setUp()
+        department_registry.invalidate()
+        self.addCleanup(department_registry.invalidate)
+
+
+class UserListQueryPlanTests(UserTestCase):
+    """Keeps the user list's queries on the indexes built for them."""
+
+    def setUp(self):
+        super().setUp()
+        if connection.vendor == 'postgresql':
+            # The test tables are empty, so stop the planner from preferring a sequential scan, or a
+            # bitmap scan of any index followed by a sort, to an index scan in the requested order
+            with connection.cursor() as cursor:
+                for planner_setting in ('enable_seqscan', 'enable_bitmapscan', 'enable_sort'):
+                    cursor.execute(f"SET LOCAL {planner_setting} = off")
+
+    def page(self, field, descending=True, nulls_last=False, after=None):
+        """The queryset `KeysetCursorPagination` runs for a page ordered by `field`."""
+        ordering = F(field).desc(**({'nulls_last': True} if nulls_last else {})) if descending else F(field).asc()
+        queryset = AuthViewSets.queryset.order_by(ordering, '-pk' if descending else 'pk')
+        if after is not None:
+            queryset = queryset.filter(KeysetCursorPagination.get_keyset_filter(field, descending, nulls_last, *after))
+        return queryset[:KeysetCursorPagination.page_size + 1]
+
+    def assertUsesIndex(self, queryset, index_name):
+        plan = queryset.explain()
+        self.assertIn(index_name, plan, f"Expected the plan to use {index_name}:\n{plan}")
+
+    def test_first_page_uses_created_at_index(self):
+        self.assertUsesIndex(self.page('created_at'), 'user_student_created_idx')
+
+    def test_following_page_uses_created_at_index(self):
+        self.assertUsesIndex(self.page('created_at', after=(timezone.now(), 'boundary')), 'user_student_created_idx')
+
+    def test_lastname_ordering_uses_lastname_index(self):
+        self.assertUsesIndex(self.page('lastname', descending=False), 'user_student_lastname_idx')
+
+    def test_last_login_ordering_uses_last_login_index(self):
+        if connection.vendor != 'postgresql':
+            self.skipTest("The last_login index is only created on Postgres")
+        self.assertUsesIndex(self.page('last_login', nulls_last=True), 'user_student_last_login_idx')
+
+    def test_upload_phone_lookup_uses_phone_index(self):
+        self.assertUsesIndex(User.objects.filter(phone__in=['08030000000', '08030000001']), 'user_phone_idx')
+
+
+class KeysetCursorPaginationTests(UserTestCase):
+    """Walks the user list page by page, both ways, over orderings with ties and NULLs."""
+    url = '/api/v1/auth/users/'
+
+    def setUp(self):
+        super().setUp()
+        now = timezone.now()
+        lastnames = ['Bello', 'Okafor', 'Bello', 'Adeyemi', 'Bello', 'Okafor', 'Zed']
+        # The user list cache is invalidated on commit
+        with self.captureOnCommitCallbacks(execute=True):
+            for i, lastname in enumerate(lastnames):
+                User.objects.create(email=f"student{i}@example.com", role='Student', firstname=f"First{i}",
+                                    lastname=lastname, phone=f"0803000{i:04d}", matric_no=f"MAT/{i}",
+                                    last_login=None if i % 3 == 0 else now - timedelta(days=i % 2))
+        self.client = APIClient()
+
+    def expected(self, ordering):
+        field = ordering.lstrip('-')
+        nulls = {'nulls_last': True} if field == 'last_login' else {}
+        if ordering.startswith('-'):
+            queryset = AuthViewSets.queryset.order_by(F(field).desc(**nulls), '-pk')
+        else:
+            queryset = AuthViewSets.queryset.order_by(F(field).asc(**nulls), 'pk')
+        return list(queryset.values_list('email', flat=True))
+
+    def get(self, url, params=None):
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200, response.data)
+        return response.data
+
+    def test_traversal_over_ties_and_nulls(self):
+        for ordering in ['lastname', '-lastname', '-last_login', 'last_login', '-created_at']:
+            with self.subTest(ordering=ordering):
+                pages = [self.get(self.url, {'ordering': ordering, 'page_size': 2})]
+                while pages[-1]['next']:
+                    pages.append(self.get(pages[-1]['next']))
+                forward = [row['email'] for page in pages for row in page['results']]
+                self.assertEqual(forward, self.expected(ordering))
+
+                backward = [pages[-1]['results']]
+                previous = pages[-1]['previous']
+                while previous:
+                    page = self.get(previous)
+                    backward.insert(0, page['results'])
+                    previous = page['previous']
+                self.assertEqual([[row['email'] for row in rows] for rows in backward],
+                                 [[row['email'] for row in page['results']] for page in pages])
+
+    def test_invalid_cursor_is_not_found(self):
+        paginator = KeysetCursorPagination()
+        paginator.base_url = f"http://testserver{self.url}"
+        for position in ['notjson', '[1]', '["garbage", "x"]', '["-created_at", "garbage", "x"]',
+                         '["-created_at", null, null]']:
+            with self.subTest(position=position):
+                response = self.client.get(paginator.encode_cursor(Cursor(offset=0, reverse=False,
+                                                                          position=position)))
+                self.assertEqual(response.status_code, 404)
+
+    def test_cursor_of_another_ordering_is_not_found(self):
+        next_link = self.get(self.url, {'ordering': 'lastname', 'page_size': 2})['next']
+        query = parse_qs(urlsplit(next_link).query)
+        query['ordering'] = ['created_at']
+        response = self.client.get(self.url, query)
+        self.assertEqual(response.status_code, 404)
+
+
+class TokenRevocationTests(UserTestCase):
+    """Changing a user's role, activity or password rejects the tokens issued before."""
+
+    def login(self, email, password):
+        response = self.client.post('/api/v1/auth/login/', {'email': email, 'password': password})
+        self.assertEqual(response.status_code, 200, response.data)
+        return response.data['access'], response.data['refresh']
+
+    def assertTokensAccepted(self, access, refresh, accepted):
+        export = self.client.get('/api/v1/auth/users/export/', HTTP_AUTHORIZATION=f"Bearer {access}")
+        self.assertEqual(export.status_code, 200 if accepted else 401)
+        refreshed = self.client.post('/api/v1/auth/token/refresh/', {'refresh': refresh})
+        self.assertEqual(refreshed.status_code, 200 if accepted else 401)
+
+    def test_revoking_changes_reject_access_and_refresh_tokens(self):
+        changes = {
+            'role': lambda user: setattr(user, 'role', 'Student'),
+            'is_active': lambda user: setattr(user, 'is_active', False),
+            'password': lambda user: user.set_password('changed-password'),
+        }
+        for field, change in changes.items():
+            with self.subTest(field=field):
+                user = User.objects.create_user(f"{field}@example.com", 'password', role='Admin')
+                access, refresh = self.login(user.email, 'password')
+                self.assertTokensAccepted(access, refresh, True)
+
+                change(user)
+                # Revocations are published to the token version cache on commit
+                with self.captureOnCommitCallbacks(execute=True):
+                    user.save()
+                self.assertTokensAccepted(access, refresh, False)
+
+
+class DeferredCredentialTests(UserTestCase):
+    """Students uploaded with deferred credentials log in with their matric number until it is hashed."""
+
+    def setUp(self):
+        super().setUp()
+        self.student = User.objects.create(email="student@example.com", role='Student', matric_no="MAT/1",
+                                           password=make_password(None), password_pending=True)
+
+    def test_matric_number_logs_in_and_is_hashed(self):
+        self.assertIsNone(authenticate(None, email="student@example.com", password="MAT/2"))
+        self.assertEqual(authenticate(None, email="student@example.com", password="MAT/1"), self.student)
+
+        self.student.refresh_from_db()
+        self.assertFalse(self.student.password_pending)
+        self.assertTrue(self.student.check_password("MAT/1"))
+        self.assertEqual(authenticate(None, email="student@example.com", password="MAT/1"), self.student)
+
+    def test_password_set_otherwise_replaces_pending_one(self):
+        self.student.set_password("new-password")
+        self.student.save()
+
+        self.assertEqual(authenticate(None, email="student@example.com", password="new-password"), self.student)
+        self.assertIsNone(authenticate(None, email="student@example.com", password="MAT/1"))
+        self.assertFalse(provision_pending_password(self.student))
+        self.student.refresh_from_db()
+        self.assertTrue(self.student.check_password("new-password"))
+
+
+class DepartmentRegistryTests(UserTestCase):
+    def test_department_saved_by_another_process_is_loaded(self):
+        self.assertNotIn("MTH", department_registry.all())
+        # The signal's callbacks are dropped, as they would only run in the process saving it
+        with self.captureOnCommitCallbacks():
+            Department.objects.create(name="Mathematics", code="MTH")
+        self.assertNotIn("MTH", department_registry.all())
+
+        bump_version(DEPARTMENT_REGISTRY_VERSION_KEY)
+        self.assertIn("MTH", department_registry.all())
+
+
+class StudentIngestTests(UserTestCase):
+    @override_settings(USER_UPLOAD_INGEST_ENGINE='copy', USER_UPLOAD_DEFER_PASSWORDS=True)
+    def test_copy_engine_inserts_rows_and_reports_conflicts(self):
+        if connection.vendor != 'postgresql':
+            self.skipTest("The copy engine only runs on Postgres")
+        department = Department.objects.create(name="Computer Science", code="CSC")
+        User.objects.create(email="Taken@Example.com", role='Student')
+        valid_rows = [(idx, {"email": email, "first_name": "First", "last_name": "Last", "middle_name": None,
+                             "phone_number": f"0803000000{idx}", "matric_number": f"MAT/{idx}",
+                             "fingerprint": idx}, department)
+                      for idx, email in enumerate(["New@Example.com", "taken@example.com", "other@example.com"])]
+        errors_list = []
+        insert_students = utils.insert_students
+
+        def record_created_ids(students):
+            record_created_ids.ids = insert_students(students)
+            return record_created_ids.ids
+
+        with mock.patch.object(utils, 'insert_students', record_created_ids):
+            self.assertEqual(utils.bulk_create_students(valid_rows, errors_list), 2)
+        self.assertEqual(errors_list, [{"row": 2, "column": "Email", "error": utils.ERROR_EMAIL_DUPLICATE,
+                                        "value": "taken@example.com"}])
+        students = User.objects.filter(upload_fingerprint__isnull=False).order_by('upload_fingerprint')
+        self.assertEqual(list(students.values_list(
+            'email', 'firstname', 'lastname', 'middle_name', 'phone', 'matric_no', 'department', 'role',
+            'upload_fingerprint', 'password_pending', 'is_active', 'is_staff', 'is_superuser', 'last_login')), [
+            ("new@example.com", "First", "Last", None, "08030000000", "MAT/0", department.pk, 'Student', 0,
+             True, True, False, False, None),
+            ("other@example.com", "First", "Last", None, "08030000002", "MAT/2", department.pk, 'Student', 2,
+             True, True, False, False, None),
+        ])
+        self.assertEqual(set(students.values_list('id', flat=True)), record_created_ids.ids)
+        for student in students:
+            self.assertFalse(student.has_usable_password())
+            self.assertIsNotNone(student.created_at)
+
+
+class FileUploadTests(UserTestCase):
+    """Runs the upload tasks in-process, on uploads stored in a temporary media root."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        media_root = tempfile.mkdtemp()
+        cls.addClassCleanup(shutil.rmtree, media_root)
+        cls.enterClassContext(override_settings(MEDIA_ROOT=media_root, USER_UPLOAD_DEFER_PASSWORDS=True,
+                                                USER_UPLOAD_BATCH_SIZE=2))
+
+    def setUp(self):
+        super().setUp()
+        Department.objects.create(name="Computer Science", code="CSC")
+        # Seven rows in four batches, the first and third of them holding an invalid row
+        self.lines = [f"student{i}@example.com,First,Last,Middle,0803000{i:04d},MAT/{i},CSC" for i in range(7)]
+        self.lines[1] = "not-an-email,First,Last,Middle,08030000001,MAT/1,CSC"
+        self.lines[5] = "student5@example.com,First,Last,Middle,08030000005,MAT/5,BAD"
+        self.errors = ["3,Email,Email is not valid,not-an-email",
+                       "7,Department Code,Department code does not exist,BAD"]
+
+    def create_upload(self, lines):
+        upload = EligibleUserUpload(total_upload=len(lines))
+        upload.file.save('upload.csv', ContentFile("\n".join([UPLOAD_HEADER, *lines, ""]).encode()))
+        return upload
+
+    def test_malformed_row_fails_upload(self):
+        lines = [f"student{i}@example.com,First,Last,Middle,0803000{i:04d},MAT/{i},CSC" for i in range(50)]
+        lines[40] += ",extra"
+        upload = self.create_upload(lines)
+
+        handle_file_upload(upload.pk)
+
+        upload.refresh_from_db()
+        self.assertEqual(upload.status, BulkStatusEnum.Failed.value)
+        self.assertEqual(upload.failure_reason,
+                         "Error reading CSV file: found more fields than defined in 'Schema'")
+        self.assertFalse(upload.chunks.exists())
+
+    def test_repeated_rows_are_reported_with_their_other_errors(self):
+        lines = [
+            "student0@example.com,First,Last,Middle,08030000000,MAT/0,CSC",
+            # Blank keys are not repeats of each other
+            "student1@example.com,First,Last,Middle,,MAT/1,CSC",
+            "student2@example.com,First,Last,Middle,,,CSC",
+            # Repeats of the first row in the next chunk, one of them by an email of another case
+            "STUDENT0@Example.com,,Last,Middle,08030000003,MAT/3,BAD",
+            "student4@example.com,First,Last,Middle,08030000000,,CSC",
+            "student5@example.com,First,Last,Middle,08030000005,MAT/5,CSC",
+        ]
+        upload = self.create_upload(lines)
+        with override_settings(USER_UPLOAD_CHUNK_SIZE=3):
+            for chunk in create_upload_chunks(upload):
+                process_upload_chunk(chunk.pk)
+
+        upload.refresh_from_db()
+        self.assertEqual((upload.number_of_valid, upload.number_of_invalid), (2, 4))
+        self.assertEqual(set(User.objects.filter(role='Student').values_list('email', flat=True)),
+                         {"student0@example.com", "student5@example.com"})
+        with upload.error_file.open('rb') as error_file:
+            self.assertEqual(error_file.read().decode().splitlines()[1:], [
+                "3,Phone Number,Phone number is not valid,",
+                "4,Phone Number,Phone number is not valid,",
+                "4,Matric Number,Matric number must not be empty,",
+                "5,Email,Email appears on an earlier row of the file,STUDENT0@Example.com",
+                "5,First Name,First name must not be empty,",
+                "5,Department Code,Department code does not exist,BAD",
+                "6,Phone Number,Phone number appears on an earlier row of the file,08030000000",
+                "6,Matric Number,Matric number must not be empty,",
+            ])
+
+    def process_upload(self, lines):
+        upload = self.create_upload(lines)
+        with utils.local_file_path(upload.file) as path:
+            upload.content_hash = utils.upload_content_hash(path, settings.USER_UPLOAD_BATCH_SIZE)
+        upload.save(update_fields=['content_hash'])
+        if not reuse_identical_upload(upload):
+            for chunk in create_upload_chunks(upload):
+                process_upload_chunk(chunk.pk)
+        upload.refresh_from_db()
+        return upload
+
+    def test_identical_upload_is_processed_again_after_its_errors_are_fixed(self):
+        lines = self.lines[:1] + self.lines[2:]
+        first = self.process_upload(lines)
+        self.assertEqual((first.number_of_valid, first.number_of_invalid), (5, 1))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Department.objects.create(name="Biochemistry", code="BAD")
+        second = self.process_upload(lines)
+        self.assertIsNone(second.duplicate_of)
+        self.assertEqual((second.number_of_valid, second.number_of_unchanged, second.number_of_invalid), (1, 5, 0))
+        self.assertTrue(User.objects.filter(email="student5@example.com", department__code="BAD").exists())
+
+        # Once it has no invalid rows the result is reused
+        third = self.process_upload(lines)
+        self.assertEqual(third.duplicate_of, second)
+        self.assertEqual(third.number_of_invalid, 0)
+
+    def create_chunk(self):
+        return create_upload_chunks(self.create_upload(self.lines))[0]
+
+    def expire_lease(self, chunk):
+        EligibleUserUploadChunk.objects.filter(pk=chunk.pk).update(lease_expires_at=timezone.now() - timedelta(seconds=1))
+
+    def assertChunkCompleted(self, chunk):
+        chunk.refresh_from_db()
+        self.assertEqual(chunk.status, BulkStatusEnum.Completed.value)
+        self.assertEqual((chunk.rows_committed, chunk.number_of_valid, chunk.number_of_invalid), (7, 5, 2))
+        self.assertEqual(User.objects.filter(role='Student').count(), 5)
+        self.assertFalse(chunk.batches.exists())
+        # Completing the last chunk finalizes the upload
+        chunk.upload.refresh_from_db()
+        self.assertEqual(chunk.upload.status, BulkStatusEnum.Completed.value)
+        with chunk.upload.error_file.open('rb') as error_file:
+            self.assertEqual(error_file.read().decode().splitlines()[1:], self.errors)
+
+    def test_chunk_resumes_from_checkpoint_after_crash(self):
+        chunk = self.create_chunk()
+        bulk_create_students = utils.bulk_create_students
+
+        def crash_on_third_batch(*args, **kwargs):
+            if crash_on_third_batch.calls == 2:
+                # A killed worker gets no chance to release its lease on the chunk
+                raise SystemExit
+            crash_on_third_batch.calls += 1
+            return bulk_create_students(*args, **kwargs)
+
+        crash_on_third_batch.calls = 0
+        with mock.patch.object(utils, 'bulk_create_students', crash_on_third_batch):
+            with self.assertRaises(SystemExit):
+                process_upload_chunk(chunk.pk)
+        chunk.refresh_from_db()
+        self.assertEqual((chunk.rows_committed, chunk.number_of_valid), (4, 3))
+
+        # The redelivered task waits for the lease of the dead run to expire, then resumes
+        with self.assertRaises(Retry):
+            process_upload_chunk(chunk.pk)
+        self.expire_lease(chunk)
+        process_upload_chunk(chunk.pk)
+        self.assertChunkCompleted(chunk)
+
+    def test_chunk_run_twice_processes_rows_once(self):
+        chunk = self.create_chunk()
+        bulk_create_students = utils.bulk_create_students
+
+        def run_again(*args, **kwargs):
+            run_again.calls += 1
+            if run_again.calls == 1:
+                # A duplicate of the task while this run holds the chunk leaves it alone
+                with self.assertRaises(Retry):
+                    process_upload_chunk(chunk.pk)
+            elif run_again.calls == 2:
+                # Once the lease expired a duplicate takes the chunk over from the checkpoint and
+                # completes it, and this run's batch is rolled back at its checkpoint
+                self.expire_lease(chunk)
+                process_upload_chunk(chunk.pk)
+            return bulk_create_students(*args, **kwargs)
+
+        run_again.calls = 0
+        with mock.patch.object(utils, 'bulk_create_students', run_again):
+            process_upload_chunk(chunk.pk)
+        self.assertChunkCompleted(chunk)
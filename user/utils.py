@@ -1,27 +1,114 @@
 import csv
+import hashlib
 import io
+import json
+import multiprocessing
 import os
-import bcrypt
+import shutil
+import tempfile
+import threading
 import aiofiles
+import django
+from contextlib import contextmanager
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from rest_framework import serializers
 import polars as pl
 from itertools import islice
 from .enums import RoleEnum
 from common.exceptions import PermissionDeniedException
 
+from django.contrib.auth.hashers import make_password
 from django.core.validators import validate_email
 from django.core.exceptions import ValidationError
-from .models import Department, User, EligibleUserUpload
+from .models import User, EligibleUserUpload
+from .cache import department_registry
 from django.conf import settings
-from django.core.files.base import ContentFile
+from django.core.files.base import File
+from django.db import connection, transaction
 
 
 def hash_password(matric_number):
     """Hash the matric_number to use as a password."""
-    # Generate a salt and hash the matric_number
-    salt = bcrypt.gensalt()
-    hashed_password = bcrypt.hashpw(matric_number.encode('utf-8'), salt)
-    return hashed_password.decode('utf-8')
+    # bcrypt in Django's "bcrypt$<hash>" format so check_password can verify it
+    return make_password(matric_number, hasher='bcrypt')
+
+
+def hash_passwords(matric_numbers, workers=None):
+    """
+    Hash a batch of matric numbers across a thread pool and return the hashes in input order.
+    bcrypt releases the GIL while hashing, so threads scale with the available cores.
+    """
+    workers = workers or settings.USER_UPLOAD_HASH_WORKERS
+    if workers <= 1 or len(matric_numbers) <= 1:
+        return [hash_password(matric_number) for matric_number in matric_numbers]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(hash_password, matric_numbers))
+
+
+UPLOAD_CSV_DTYPES = {
+    'Email': pl.Utf8,
+    'First Name': pl.Utf8,
+    'Last Name': pl.Utf8,
+    'Middle Name': pl.Utf8,
+    'Phone Number': pl.Utf8,
+    'Matric Number': pl.Utf8,
+    'Department Code': pl.Utf8,
+}
+
+
+def read_upload_csv(file, skip_rows=0, n_rows=None):
+    """
+    Read an eligible student upload into a DataFrame, keeping every expected column as text.
+    `skip_rows` and `n_rows` select a range of data rows, e.g. a single chunk of the upload.
+    """
+    return pl.read_csv(file, dtypes=UPLOAD_CSV_DTYPES, skip_rows_after_header=skip_rows, n_rows=n_rows)
+
+
+def scan_upload_csv(path):
+    """Lazily scan a CSV upload, so queries over it only read the columns they use, in a stream."""
+    return pl.scan_csv(path, dtypes=UPLOAD_CSV_DTYPES)
+
+
+def read_upload_batches(path, batch_size, skip_rows=0, n_rows=None):
+    """
+    Yield the data rows of a CSV upload as DataFrames of `batch_size` rows (the last one may be
+    shorter), reading the file incrementally so memory stays flat whatever its size.
+    """
+    reader = pl.read_csv_batched(path, dtypes=UPLOAD_CSV_DTYPES, skip_rows_after_header=skip_rows, n_rows=n_rows,
+                                 batch_size=batch_size)
+    pending = None
+    while frames := reader.next_batches(1):
+        frame = frames[0] if pending is None else pl.concat([pending, frames[0]])
+        while frame.height >= batch_size:
+            yield frame.slice(0, batch_size)
+            frame = frame.slice(batch_size)
+        pending = frame
+    if pending is not None and pending.height:
+        yield pending
+
+
+@contextmanager
+def local_file_path(field_file):
+    """
+    Yield a local path to a stored file, downloading it to a temporary file when its storage
+    does not keep files on the local filesystem.
+    """
+    try:
+        path = field_file.path
+    except NotImplementedError:
+        path = None
+    if path:
+        yield path
+        return
+
+    with tempfile.NamedTemporaryFile(suffix=os.path.splitext(field_file.name)[1]) as local_file:
+        with field_file.open('rb'):
+            for chunk in field_file.chunks():
+                local_file.write(chunk)
+        local_file.flush()
+        yield local_file.name
 
 
 def validate_eligible_student_upload(attrs, user: User, expected_headers):
@@ -29,23 +116,21 @@ def validate_eligible_student_upload(attrs, user: User, expected_headers):
     if not file.name.lower().endswith('.csv'):
         raise serializers.ValidationError({"file": "File must be a CSV file"})
 
+    # Large uploads are streamed to a temporary file by Django; small ones are already in memory
+    source = file.temporary_file_path() if hasattr(file, 'temporary_file_path') else file.read()
     try:
-        data_stream = pl.read_csv(file, dtypes={
-            'Email': pl.Utf8,
-            'First Name': pl.Utf8,
-            'Last Name': pl.Utf8,
-            'Middle Name': pl.Utf8,
-            'Phone Number': pl.Utf8,
-            'Matric Number': pl.Utf8,
-            'Department Code': pl.Utf8,
-        })
+        # Only the header and first row are parsed; the rows are counted by a streaming scan
+        head = read_upload_csv(source, n_rows=1)
+        row = scan_upload_csv(source).select(pl.len()).collect().item() if head.height else 0
 
     except Exception as e:
 
         raise serializers.ValidationError({"file": f"Error reading CSV file: {str(e)}"})
 
-    headers = set(data_stream.columns)
-    row = data_stream.height
+    finally:
+        file.seek(0)
+
+    headers = set(head.columns)
 
     if row < 1:
         raise serializers.ValidationError({"file": "File must not be empty"})
@@ -60,7 +145,7 @@ def validate_eligible_student_upload(attrs, user: User, expected_headers):
             raise serializers.ValidationError(
                 {"file": f"Header '{header}' contains special characters, which are not allowed."})
 
-    return data_stream, row
+    return row
 
 
 ERROR_EMAIL_INVALID = "Email is not valid"
@@ -73,23 +158,56 @@ ERROR_MATRIC_NUMBER_EMPTY = "Matric number must not be empty"
 ERROR_MATRIC_NUMBER_EXISTS = "Matric number already exists"
 ERROR_DEPARTMENT_CODE_INVALID = "Department code does not exist"
 ERROR_PHONE_NUMBER_EXISTS = "Phone number already exists"
-
-
-def validate_email_field(email, idx, errors_list):
+ERROR_EMAIL_DUPLICATE_IN_FILE = "Email appears on an earlier row of the file"
+ERROR_PHONE_DUPLICATE_IN_FILE = "Phone number appears on an earlier row of the file"
+ERROR_MATRIC_NUMBER_DUPLICATE_IN_FILE = "Matric number appears on an earlier row of the file"
+
+# Position of each error among the errors of a row, following the order of the checks
+ERROR_ORDER = {
+    ERROR_EMAIL_INVALID: 0,
+    ERROR_EMAIL_DUPLICATE: 0,
+    ERROR_EMAIL_DUPLICATE_IN_FILE: 0,
+    ERROR_FIRST_NAME_EMPTY: 1,
+    ERROR_LAST_NAME_EMPTY: 2,
+    ERROR_MIDDLE_NAME_EMPTY: 3,
+    ERROR_PHONE_INVALID: 4,
+    ERROR_PHONE_NUMBER_EXISTS: 4,
+    ERROR_PHONE_DUPLICATE_IN_FILE: 4,
+    ERROR_MATRIC_NUMBER_EMPTY: 5,
+    ERROR_MATRIC_NUMBER_EXISTS: 5,
+    ERROR_MATRIC_NUMBER_DUPLICATE_IN_FILE: 5,
+    ERROR_DEPARTMENT_CODE_INVALID: 6,
+}
+
+# Cheap regex that only rejects emails Django's validate_email would reject too
+EMAIL_PREFILTER_PATTERN = r'^.+@[^@\s]+$'
+PHONE_NUMBER_PATTERN = r'^\d+$'
+
+
+def sort_errors(errors_list):
+    """Sort error records by row, then in the order the row's checks run."""
+    errors_list.sort(key=lambda error: (error["row"], ERROR_ORDER.get(error["error"], len(ERROR_ORDER))))
+
+
+def validate_email_field(email, idx, errors_list, existing_emails=None):
     try:
         validate_email(email)
     except ValidationError:
         errors_list.append({"row": idx + 1, "column": "Email", "error": ERROR_EMAIL_INVALID, "value": email})
         return False
-    if User.objects.filter(email=email).exists():
+    if existing_emails is None:
+        exists = User.objects.filter(email=email.lower()).exists()
+    else:
+        exists = email.lower() in existing_emails
+    if exists:
         errors_list.append({"row": idx + 1, "column": "Email", "error": ERROR_EMAIL_DUPLICATE, "value": email})
         return False
     return True
 
 
 # Validate Department Code
-def validate_department_code(department_code, idx, errors_list):
-    department = Department.objects.filter(code=department_code).first()
+def validate_department_code(department_code, idx, errors_list, departments=None):
+    department = (department_registry if departments is None else departments).get(department_code)
     if not department:
         errors_list.append({"row": idx + 1, "column": "Department Code", "error": ERROR_DEPARTMENT_CODE_INVALID, "value": department_code
                             })
@@ -121,12 +239,16 @@ def validate_middle_name(middle_name, idx, errors_list):
     return True
 
 
-def validate_phone_number(phone_number, idx, errors_list):
+def validate_phone_number(phone_number, idx, errors_list, existing_phones=None):
     if not phone_number.isdigit():
         errors_list.append({"row": idx + 1, "column": "Phone Number", "error": ERROR_PHONE_INVALID, "value": phone_number
                             })
         return False
-    if User.objects.filter(phone=phone_number).exists():
+    if existing_phones is None:
+        exists = User.objects.filter(phone=phone_number).exists()
+    else:
+        exists = phone_number in existing_phones
+    if exists:
         errors_list.append(
             {"row": idx + 1, "column": "Phone Number", "error": ERROR_PHONE_NUMBER_EXISTS, "value": phone_number
              })
@@ -134,14 +256,18 @@ def validate_phone_number(phone_number, idx, errors_list):
     return True
 
 
-def validate_matric_number(matric_number, idx, errors_list):
+def validate_matric_number(matric_number, idx, errors_list, existing_matric_numbers=None):
     if not matric_number or matric_number.strip() == "":
         errors_list.append(
             {
                 "row": idx + 1, "column": "Matric Number", "error": ERROR_MATRIC_NUMBER_EMPTY, "value": matric_number
             })
         return False
-    if User.objects.filter(matric_no=matric_number).exists():
+    if existing_matric_numbers is None:
+        exists = User.objects.filter(matric_no=matric_number).exists()
+    else:
+        exists = matric_number in existing_matric_numbers
+    if exists:
         errors_list.append(
             {
                 "row": idx + 1, "column": "Matric Number", "error": ERROR_MATRIC_NUMBER_EXISTS, "value": matric_number
@@ -157,93 +283,550 @@ def batch_generator(data_stream, batch_size):
         yield [first] + list(islice(it, batch_size - 1))
 
 
-def validate_file_upload_data(data_stream, file_upload: EligibleUserUpload, batch_size=100):
+UPLOAD_COLUMNS = {
+    'Email': 'email',
+    'First Name': 'first_name',
+    'Last Name': 'last_name',
+    'Middle Name': 'middle_name',
+    'Phone Number': 'phone_number',
+    'Matric Number': 'matric_number',
+    'Department Code': 'department_code',
+}
+
+
+def clean_upload_row(row):
+    """Strip every expected column of a CSV row, treating missing values as empty strings."""
+    return {name: (row.get(header) or '').strip() for header, name in UPLOAD_COLUMNS.items()}
+
+
+def load_departments():
+    """Map every department code to its Department, from the process-local registry."""
+    return department_registry.all()
+
+
+def fetch_existing_user_values(rows):
     """
-    This function processes file uploads in batches, validates rows, writes errors to a CSV file,
-    and returns an array of valid rows.
+    Look up which emails, phone numbers and matric numbers of a batch of cleaned rows already
+    belong to a user, using one `__in` query per column instead of one query per row. Emails are
+    returned, and should be compared, lower case.
+    """
+    emails = {row['email'].lower() for row in rows if row['email']}
+    phone_numbers = {row['phone_number'] for row in rows if row['phone_number']}
+    matric_numbers = {row['matric_number'] for row in rows if row['matric_number']}
+    return {
+        'existing_emails': set(User.objects.filter(email__in=emails).values_list('email', flat=True)),
+        'existing_phones': set(User.objects.filter(phone__in=phone_numbers).values_list('phone', flat=True)),
+        'existing_matric_numbers': set(
+            User.objects.filter(matric_no__in=matric_numbers).values_list('matric_no', flat=True)),
+    }
+
+
+def validate_upload_row(row, idx, errors_list, existing=None, departments=None):
+    """
+    Validate a cleaned CSV row, appending its errors to `errors_list`.
+
+    `existing` (see `fetch_existing_user_values`) and `departments` (see `load_departments`) are
+    the prefetched lookups of the batched path; when they are omitted every user check queries the
+    database on its own, and departments come from the process-local registry.
+    """
+    existing = existing or {}
+    is_error = False
+    if not validate_email_field(row['email'], idx, errors_list, existing.get('existing_emails')):
+        is_error = True
+    if not validate_first_name(row['first_name'], idx, errors_list):
+        is_error = True
+    if not validate_last_name(row['last_name'], idx, errors_list):
+        is_error = True
+    if not validate_middle_name(row['middle_name'], idx, errors_list):
+        is_error = True
+    if not validate_phone_number(row['phone_number'], idx, errors_list, existing.get('existing_phones')):
+        is_error = True
+    if not validate_matric_number(row['matric_number'], idx, errors_list, existing.get('existing_matric_numbers')):
+        is_error = True
+    is_dept_valid, dept = validate_department_code(row['department_code'], idx, errors_list, departments)
+    if not is_dept_valid and dept is None:
+        is_error = True
+    return not is_error, dept
+
+
+# Columns that must be unique within an upload, with how their values are compared
+UPLOAD_KEY_COLUMNS = [
+    ('Email', ERROR_EMAIL_DUPLICATE_IN_FILE, pl.col('Email').str.to_lowercase()),
+    ('Phone Number', ERROR_PHONE_DUPLICATE_IN_FILE, pl.col('Phone Number')),
+    ('Matric Number', ERROR_MATRIC_NUMBER_DUPLICATE_IN_FILE, pl.col('Matric Number')),
+]
+
+
+def find_duplicate_rows(data_stream, start_row=0):
+    """
+    Find the rows repeating the email, phone number or matric number of an earlier row of the
+    upload, in one hash-based pass over the normalized key columns. Returns their error records;
+    the first occurrence of a value is not reported.
+    `data_stream` may be a LazyFrame from `scan_upload_csv`, so only the key columns are read.
+    """
+    frame = data_stream.lazy().select(
+        (pl.int_range(pl.len(), dtype=pl.Int64) + start_row + 1).alias('idx'),
+        *[pl.col(header).cast(pl.Utf8).fill_null('').str.strip_chars() for header, _, _ in UPLOAD_KEY_COLUMNS],
+    )
+    errors = pl.concat([
+        frame.filter((pl.col(header) != '') & ~key.is_first_distinct()).select(
+            (pl.col('idx') + 1).alias('row'),
+            pl.lit(header).alias('column'),
+            pl.lit(error).alias('error'),
+            pl.col(header).alias('value'),
+        )
+        for header, error, key in UPLOAD_KEY_COLUMNS
+    ])
+    return errors.sort('row', maintain_order=True).collect().to_dicts()
+
+
+def normalized_upload_keys(batch):
+    """
+    One string per row of a raw upload batch: its stripped columns joined by a unit separator,
+    the email lower cased, so rows differing only by padding or email case compare equal.
+    """
+    columns = []
+    for header in UPLOAD_COLUMNS:
+        column = pl.col(header).cast(pl.Utf8).fill_null('').str.strip_chars()
+        columns.append(column.str.to_lowercase() if header == 'Email' else column)
+    return batch.select(pl.concat_str(columns, separator='\x1f')).to_series()
+
+
+def row_fingerprint(key):
+    """A stable 64-bit fingerprint of a normalized row, signed to fit a BigIntegerField."""
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), 'big', signed=True)
+
+
+def upload_content_hash(path, batch_size):
+    """SHA-256 of the normalized rows of an upload, read incrementally."""
+    digest = hashlib.sha256()
+    for batch in read_upload_batches(path, batch_size):
+        for key in normalized_upload_keys(batch):
+            digest.update(key.encode())
+            digest.update(b'\n')
+    return digest.hexdigest()
+
+
+def find_unchanged_rows(batch, start_row=0):
+    """
+    Fingerprint the rows of a raw upload batch and find those that already created a student in
+    an earlier upload, with one indexed query. Returns the fingerprints by row number, and the
+    row numbers of the unchanged rows.
+    """
+    fingerprints = {start_row + offset: row_fingerprint(key)
+                    for offset, key in enumerate(normalized_upload_keys(batch), start=1)}
+    known = set(User.objects.filter(upload_fingerprint__in=set(fingerprints.values())).values_list(
+        'upload_fingerprint', flat=True))
+    return fingerprints, {idx for idx, fingerprint in fingerprints.items() if fingerprint in known}
+
+
+def is_valid_email(email):
+    try:
+        validate_email(email)
+    except ValidationError:
+        return False
+    return True
+
+
+def format_error_frame(frame, mask, column, error, value):
+    """Error records, as a frame, of the rows of `frame` where `mask` is False."""
+    return frame.filter(~mask).select(
+        (pl.col('idx') + 1).alias('row'),
+        pl.lit(column).alias('column'),
+        pl.lit(error).alias('error'),
+        pl.col(value).alias('value'),
+    )
+
+
+def prevalidate_upload_rows(data_stream, start_row=0, skip_rows=()):
+    """
+    Run the format checks of an upload (names, phone digits, matric emptiness and email syntax)
+    as Polars expressions over whole columns.
+
+    Returns the error records of those checks and a frame of the cleaned rows, numbered in `idx`
+    and carrying `email_ok`, `phone_ok` and `format_ok` flags for the database checks that follow.
+    Only emails passing the regex prefilter go through Django's `validate_email`. Rows numbered in
+    `skip_rows` are left out.
+    """
+    frame = data_stream.select(
+        (pl.int_range(pl.len(), dtype=pl.Int64) + start_row + 1).alias('idx'),
+        *[pl.col(header).cast(pl.Utf8).fill_null('').str.strip_chars().alias(name)
+          for header, name in UPLOAD_COLUMNS.items()],
+    ).filter(~pl.col('idx').is_in(list(skip_rows))).with_columns(
+        pl.col('email').str.contains(EMAIL_PREFILTER_PATTERN).alias('email_ok'),
+        pl.col('phone_number').str.contains(PHONE_NUMBER_PATTERN).alias('phone_ok'),
+    )
+    frame = frame.with_columns(pl.Series('email_ok', [
+        email_ok and is_valid_email(email) for email, email_ok in zip(frame['email'], frame['email_ok'])
+    ], dtype=pl.Boolean))
+
+    checks = [
+        (pl.col('email_ok'), "Email", ERROR_EMAIL_INVALID, 'email'),
+        (pl.col('first_name') != '', "First Name", ERROR_FIRST_NAME_EMPTY, 'first_name'),
+        (pl.col('last_name') != '', "Last Name", ERROR_LAST_NAME_EMPTY, 'last_name'),
+        (pl.col('middle_name') != '', "Last Name", ERROR_MIDDLE_NAME_EMPTY, 'middle_name'),
+        (pl.col('phone_ok'), "Phone Number", ERROR_PHONE_INVALID, 'phone_number'),
+        (pl.col('matric_number') != '', "Matric Number", ERROR_MATRIC_NUMBER_EMPTY, 'matric_number'),
+    ]
+    errors = pl.concat([format_error_frame(frame, mask, *check) for mask, *check in checks])
+    frame = frame.with_columns(pl.all_horizontal([mask for mask, *_ in checks]).alias('format_ok'))
+    return errors.sort('row', maintain_order=True).to_dicts(), frame
+
+
+class ValidationProcessPool:
+    """
+    Process-local pool of `USER_UPLOAD_VALIDATION_WORKERS` processes for
+    `prevalidate_upload_partitions`. It is started on first use and kept for the life of the
+    process, so the workers' interpreters and `django.setup()` are paid for once, not per chunk.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pool = None
+        self._key = None
+
+    def get(self):
+        """
+        The pool, or None when `USER_UPLOAD_VALIDATION_WORKERS` is below two or the current process
+        is daemonic (e.g. a Celery prefork child), which may not start processes of its own.
+        """
+        workers = settings.USER_UPLOAD_VALIDATION_WORKERS
+        if workers < 2 or multiprocessing.current_process().daemon:
+            return None
+        key = (os.getpid(), workers)
+        with self._lock:
+            if self._key != key:
+                # A pool inherited through a fork belongs to the parent, and is left to it
+                if self._pool is not None and self._key[0] == key[0]:
+                    self._pool.shutdown(wait=False)
+                # Polars' thread pool does not survive a fork, so the workers are spawned
+                self._pool = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn'),
+                                                 initializer=django.setup)
+                self._key = key
+            return self._pool
+
+    def discard(self, pool):
+        """Drop a pool found broken, e.g. after one of its processes was killed; `get` starts another."""
+        with self._lock:
+            if self._pool is pool:
+                self._pool = self._key = None
+        pool.shutdown(wait=False)
+
+
+validation_process_pool = ValidationProcessPool()
+
+
+def prevalidate_upload_partitions(batch, start_row=0, skip_rows=(), pool=None):
+    """
+    `prevalidate_upload_rows` over one partition of `batch` per worker of `pool`, merged back in
+    row order. Runs in the current process when there is no pool, or when it is broken.
+    """
+    partitions = settings.USER_UPLOAD_VALIDATION_WORKERS if pool is not None else 1
+    if partitions < 2 or batch.height < partitions:
+        return prevalidate_upload_rows(batch, start_row, skip_rows)
+    size = -(-batch.height // partitions)
+    try:
+        futures = []
+        for offset in range(0, batch.height, size):
+            first, last = start_row + offset, start_row + offset + size
+            futures.append(pool.submit(prevalidate_upload_rows, batch.slice(offset, size), first,
+                                       {idx for idx in skip_rows if first < idx <= last}))
+        results = [future.result() for future in futures]
+    except BrokenProcessPool:
+        validation_process_pool.discard(pool)
+        return prevalidate_upload_rows(batch, start_row, skip_rows)
+    return [error for errors, _ in results for error in errors], pl.concat([frame for _, frame in results])
+
+
+def validate_upload_batch(rows, errors_list, departments, repeated_rows=()):
+    """
+    Run the database checks on a batch of rows from `prevalidate_upload_rows` and return the
+    `(idx, row, department)` triples of the valid ones. The batch costs three queries regardless
+    of its size; rows that failed a format check are still checked on their well-formed fields
+    so the error file lists every problem of a row. The values of each valid row count as
+    existing for the rows after it, as they would once it is inserted.
+    Rows numbered in `repeated_rows` repeat a key of an earlier row of the upload (see
+    `find_duplicate_rows`): they are invalid and only get the department check.
+    """
+    existing = fetch_existing_user_values(rows)
+    valid_rows = []
+    for row in rows:
+        idx = row['idx']
+        is_error = not row['format_ok']
+        if idx in repeated_rows:
+            validate_department_code(row['department_code'], idx, errors_list, departments)
+            continue
+        if row['email_ok'] and row['email'].lower() in existing['existing_emails']:
+            errors_list.append({"row": idx + 1, "column": "Email", "error": ERROR_EMAIL_DUPLICATE,
+                                "value": row['email']})
+            is_error = True
+        if row['phone_ok'] and row['phone_number'] in existing['existing_phones']:
+            errors_list.append({"row": idx + 1, "column": "Phone Number", "error": ERROR_PHONE_NUMBER_EXISTS,
+                                "value": row['phone_number']})
+            is_error = True
+        if row['matric_number'] and row['matric_number'] in existing['existing_matric_numbers']:
+            errors_list.append({"row": idx + 1, "column": "Matric Number", "error": ERROR_MATRIC_NUMBER_EXISTS,
+                                "value": row['matric_number']})
+            is_error = True
+        is_dept_valid, dept = validate_department_code(row['department_code'], idx, errors_list, departments)
+        if not is_dept_valid and dept is None:
+            is_error = True
+        if not is_error:
+            valid_rows.append((idx, row, dept))
+            existing['existing_emails'].add(row['email'].lower())
+            existing['existing_phones'].add(row['phone_number'])
+            existing['existing_matric_numbers'].add(row['matric_number'])
+    return valid_rows
+
+
+def provision_pending_password(user):
+    """
+    Store the first password of a student uploaded with deferred credentials. Returns False when
+    the password was provisioned concurrently, e.g. by the background sweep.
+    """
+    user.set_password(user.matric_no)
+    user.password_pending = False
+    return bool(User.objects.filter(pk=user.pk, password_pending=True).update(
+        password=user.password, password_pending=False))
+
+
+def build_student(row, dept, password, password_pending=False):
+    """Build an unsaved student from a validated row."""
+    return User(email=row['email'].lower(),
+                firstname=row['first_name'],
+                lastname=row['last_name'],
+                middle_name=row['middle_name'],
+                matric_no=row['matric_number'],
+                phone=row['phone_number'],
+                department=dept,
+                role=RoleEnum.Student.value,
+                password=password,
+                password_pending=password_pending,
+                upload_fingerprint=row.get('fingerprint'),
+                )
+
+
+def insert_students(students):
+    """
+    Insert unsaved students, skipping those that conflict with an existing user, and return the
+    ids of the ones created. Uses `copy_insert_students` when `USER_UPLOAD_INGEST_ENGINE` is
+    "copy" on Postgres, `bulk_create` otherwise.
+    """
+    if settings.USER_UPLOAD_INGEST_ENGINE == 'copy' and connection.vendor == 'postgresql':
+        return copy_insert_students(students)
+    User.objects.bulk_create(students, ignore_conflicts=True)
+    return set(User.objects.filter(id__in=[student.id for student in students]).values_list('id', flat=True))
+
+
+def copy_insert_students(students):
+    """
+    Stream students into a temporary staging table with `COPY FROM STDIN`, then move them into
+    the user table with `INSERT ... SELECT ... ON CONFLICT DO NOTHING RETURNING id`, which skips
+    rows violating any unique index. Runs in the caller's transaction; the staging table is
+    dropped once its rows are moved, so several batches can go through one transaction.
+    """
+    fields = User._meta.concrete_fields
+    columns = ', '.join(connection.ops.quote_name(field.column) for field in fields)
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for student in students:
+        values = [field.get_db_prep_save(field.pre_save(student, True), connection) for field in fields]
+        writer.writerow(r'\N' if value is None else value for value in values)
+    buffer.seek(0)
+
+    table = connection.ops.quote_name(User._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.execute(f"CREATE TEMPORARY TABLE user_user_staging (LIKE {table}) ON COMMIT DROP")
+        cursor.copy_expert(
+            f"COPY user_user_staging ({columns}) FROM STDIN WITH (FORMAT csv, NULL '\\N')", buffer)
+        cursor.execute(f"INSERT INTO {table} ({columns}) SELECT {columns} FROM user_user_staging "
+                       f"ON CONFLICT DO NOTHING RETURNING id")
+        created_ids = {row[0] for row in cursor.fetchall()}
+        cursor.execute("DROP TABLE user_user_staging")
+    return created_ids
+
+
+def bulk_create_students(valid_rows, errors_list, checkpoint=None):
+    """
+    Insert the validated `(idx, row, department)` triples of a batch with a single `bulk_create`
+    in its own transaction and return the number of students created.
+
+    Rows that conflict with a user created since the batch was validated are skipped instead of
+    aborting the batch, and reported in `errors_list` as duplicate emails.
+
+    `checkpoint` is called with the number created and `errors_list` inside that transaction, so
+    whatever it records commits together with the students, or not at all.
+
+    With `USER_UPLOAD_DEFER_PASSWORDS` the students are created with an unusable password and
+    flagged `password_pending`; their matric number is hashed on first login or by the
+    `provision_pending_credentials` task instead.
+    """
+    if not valid_rows and checkpoint is None:
+        return 0
+    defer_passwords = settings.USER_UPLOAD_DEFER_PASSWORDS
+    if defer_passwords:
+        passwords = [make_password(None) for _ in valid_rows]
+    else:
+        passwords = hash_passwords([row['matric_number'] for _, row, _ in valid_rows])
+    students = {idx: build_student(row, dept, password, password_pending=defer_passwords)
+                for (idx, row, dept), password in zip(valid_rows, passwords)}
+
+    with transaction.atomic():
+        created_ids = insert_students(list(students.values())) if students else set()
+
+        for idx, student in students.items():
+            if student.id not in created_ids:
+                errors_list.append(
+                    {"row": idx + 1, "column": "Email", "error": ERROR_EMAIL_DUPLICATE, "value": student.email})
+        if checkpoint is not None:
+            checkpoint(len(created_ids), errors_list)
+    return len(created_ids)
+
+
+class ErrorFileWriter:
+    """
+    Incremental sink for the error records of an upload: rows are appended as CSV to a spooled
+    temporary file as batches finish, which stays in memory while small and rolls over to disk
+    past `FILE_UPLOAD_MAX_MEMORY_SIZE`, then saved to storage once.
     """
     headers = ["Row", "Column", "Error", "Value"]
-    errors_list = []
+
+    def __init__(self):
+        self.file = tempfile.SpooledTemporaryFile(max_size=settings.FILE_UPLOAD_MAX_MEMORY_SIZE, mode='w+',
+                                                  newline='', encoding='utf-8')
+        self.writer = csv.writer(self.file)
+        self.count = 0
+
+    def write(self, errors):
+        """Append error records, sorted by row and check order."""
+        if not errors:
+            return
+        if not self.count:
+            self.writer.writerow(self.headers)
+        sort_errors(errors)
+        self.writer.writerows([error["row"], error["column"], error["error"], error["value"]] for error in errors)
+        self.count += len(errors)
+
+    def to_file(self, filename):
+        """The written errors as a file to assign to a FileField, or None when there were none."""
+        if not self.count:
+            self.file.close()
+            return None
+        self.file.seek(0)
+        return File(self.file, name=filename)
+
+
+def validate_file_upload_data(data_stream, file_upload: EligibleUserUpload, batch_size=100, start_row=0,
+                              duplicate_errors=None, progress=None, checkpoint=None, previous_errors=None):
+    """
+    This function processes file uploads in batches, validates rows, writes errors to a CSV file,
+    and returns the error file with the numbers of students created and of unchanged rows.
+    `data_stream` is either a DataFrame or an iterable of record batches, e.g. from
+    `read_upload_batches`. `start_row` is its offset in the uploaded file when it holds a single
+    chunk, in which case `duplicate_errors` are the chunk's rows found by `find_duplicate_rows`
+    over the whole file. Those rows are reported with their format and department errors, and
+    never inserted.
+    Rows that already created a student in an earlier upload (see `find_unchanged_rows`) are
+    skipped without being validated or reported.
+    `progress`, an `UploadProgress`, is given the counts of each batch once it is inserted.
+    `checkpoint(rows, unchanged, created, errors)` is called in the transaction inserting each
+    batch (see `EligibleUserUploadChunk.checkpoint`), and `previous_errors` are the error records
+    of the batches processed before a resumed run, a list per batch, written to the error file first.
+    """
     valid_row_number = 0
+    unchanged_row_number = 0
+    error_file = ErrorFileWriter()
+    for errors in previous_errors or []:
+        error_file.write(errors)
+    filename = f"batch_upload_error_file{file_upload.pk}-{start_row}.csv"
 
     try:
+        if isinstance(data_stream, pl.DataFrame):
+            if duplicate_errors is None:
+                duplicate_errors = find_duplicate_rows(data_stream, start_row)
+            data_stream = data_stream.iter_slices(batch_size)
+        duplicate_errors = duplicate_errors or []
+        repeated_rows = {error["row"] - 1 for error in duplicate_errors}
         # Batch process the rows
-        for batch_idx, batch in enumerate(batch_generator(data_stream.rows(named=True), batch_size), start=1):
-            print(f"Processing batch {batch_idx}")
-
-            for idx, row in enumerate(batch, start=(batch_idx - 1) * batch_size + 1):
-                email = (row.get('Email') or '').strip()
-                first_name = (row.get('First Name') or '').strip()
-                last_name = (row.get('Last Name') or '').strip()
-                middle_name = (row.get('Middle Name') or '').strip()
-                phone_number = (row.get('Phone Number') or '').strip()
-                matric_number = (row.get('Matric Number') or '').strip()
-                department_code = (row.get('Department Code') or '').strip()
-
-                # Validate fields
-                is_error = False
-                if not validate_email_field(email, idx, errors_list):
-                    is_error = True
-
-                if not validate_first_name(first_name, idx, errors_list):
-                    is_error = True
-                if not validate_last_name(last_name, idx, errors_list):
-                    is_error = True
-                if not validate_middle_name(middle_name, idx, errors_list):
-                    is_error = True
-                if not validate_phone_number(phone_number, idx, errors_list):
-                    is_error = True
-                if not validate_matric_number(matric_number, idx, errors_list):
-                    is_error = True
-                is_dept_valid, dept = validate_department_code(department_code, idx, errors_list)
-                if not is_dept_valid and dept is None:
-                    is_error = True
-
-                # Only process and append valid rows
-                if not is_error:
-                    User.objects.create(email=email,
-                                        firstname=first_name,
-                                        lastname=last_name,
-                                        middle_name=middle_name,
-                                        matric_no=matric_number,
-                                        phone=phone_number,
-                                        department=dept,
-                                        role=RoleEnum.Student.value,
-                                        password=hash_password(matric_number),
-                                        )
-
-                    valid_row_number += 1
-
-        # Prepare CSV content for errors
-        file = None
-        if errors_list:
-            output = io.StringIO()
-            writer = csv.writer(output)
-
-            writer.writerow(headers)
-            for error in errors_list:
-                writer.writerow([
-                    error["row"],
-                    error["column"],
-                    error["error"],
-                    error["value"]
-                ])
-
-            # Save CSV file
-            csv_content = output.getvalue()
-            output.close()
-
-            filename = f"batch_upload_error_file{file_upload.pk}.csv"
-            file_path = os.path.join(settings.MEDIA_ROOT, filename)
-
-            with open(file_path, 'w', newline='') as file:
-                file.write(csv_content)
-
-            file = ContentFile(csv_content, name=filename)
-
-        # Return the file and array of valid rows
-        return file, valid_row_number
+        for batch in data_stream:
+            # Reloaded when a department changed in any process, see DepartmentRegistry
+            departments = load_departments()
+            errors_list = [error for error in duplicate_errors
+                           if start_row < error["row"] - 1 <= start_row + batch.height]
+            fingerprints, unchanged_rows = find_unchanged_rows(batch, start_row)
+            unchanged_rows -= repeated_rows
+            # Format checks run vectorized over the batch's columns, leaving the database checks
+            format_errors, rows = prevalidate_upload_partitions(batch, start_row, unchanged_rows,
+                                                                validation_process_pool.get())
+            errors_list.extend(format_errors)
+            valid_rows = validate_upload_batch(rows.rows(named=True), errors_list, departments, repeated_rows)
+            for idx, row, _ in valid_rows:
+                row['fingerprint'] = fingerprints[idx]
+            created = bulk_create_students(valid_rows, errors_list,
+                                           checkpoint and partial(checkpoint, batch.height, len(unchanged_rows)))
+            valid_row_number += created
+            unchanged_row_number += len(unchanged_rows)
+            error_file.write(errors_list)
+            start_row += batch.height
+            if progress is not None:
+                progress.add(batch.height, created, len(unchanged_rows))
+
+        # Return the file and the counts of the rows
+        return error_file.to_file(filename), valid_row_number, unchanged_row_number
 
     except Exception as e:
         print(f"Error during processing: {str(e)}")
         raise e
+
+
+def save_error_parquet(file_upload: EligibleUserUpload):
+    """
+    Store a compact Parquet copy of an upload's error CSV next to it, streaming the conversion
+    through Polars rather than loading the errors in memory.
+    """
+    with local_file_path(file_upload.error_file) as path:
+        errors = pl.scan_csv(path, dtypes={"Row": pl.Int64, "Column": pl.Utf8, "Error": pl.Utf8, "Value": pl.Utf8})
+        with tempfile.NamedTemporaryFile(suffix='.parquet') as parquet_file:
+            errors.sink_parquet(parquet_file.name)
+            filename = f"{os.path.splitext(os.path.basename(file_upload.error_file.name))[0]}.parquet"
+            file_upload.error_parquet_file.save(filename, File(parquet_file), save=False)
+
+
+def merge_error_files(error_files, filename):
+    """
+    Concatenate the error CSVs of an upload's chunks, in order and keeping a single header row,
+    into one file ready to be assigned to `EligibleUserUpload.error_file`.
+    """
+    merged = tempfile.SpooledTemporaryFile(max_size=settings.FILE_UPLOAD_MAX_MEMORY_SIZE)
+    for error_file in error_files:
+        with error_file.open('rb') as part:
+            header = part.readline()
+            if not merged.tell():
+                merged.write(header)
+            shutil.copyfileobj(part, merged)
+    if not merged.tell():
+        merged.close()
+        return None
+    merged.seek(0)
+    return File(merged, name=filename)
+
+
+class _Echo:
+    """File-like object handing back what is written to it, so a csv writer can produce lines."""
+
+    def write(self, value):
+        return value
+
+
+def stream_csv_rows(rows, fields):
+    """Yield a header line then one CSV line per dict of `rows`, for a streaming response."""
+    writer = csv.writer(_Echo())
+    yield writer.writerow(fields)
+    for row in rows:
+        yield writer.writerow([row[field] for field in fields])
+
+
+def stream_ndjson_rows(rows, fields):
+    """Yield one JSON object per line per dict of `rows`, for a streaming response."""
+    for row in rows:
+        yield json.dumps({field: row[field] for field in fields}) + "\n"
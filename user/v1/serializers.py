@@ -8,13 +8,17 @@ from user.tasks import handle_file_upload
 from django.db import transaction
 from django.utils.translation import gettext_lazy as _
 from django.contrib.auth import get_user_model, authenticate
-from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.serializers import TokenObtainPairSerializer, TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from user.cache import get_token_version, progress_stats, UploadProgress
+from user.enums import BulkStatusEnum
+from django.utils import timezone
 from common.helper import run_async
 
 
 class EligibleUserUploadSerializer(serializers.ModelSerializer):
     file = serializers.FileField()
-    data_stream = None
 
     class Meta:
         model = EligibleUserUpload
@@ -27,25 +31,47 @@ class EligibleUserUploadSerializer(serializers.ModelSerializer):
         expected_headers = {"Email", "First Name", "Last Name", "Middle Name", "Phone Number", "Matric Number",
                             "Department Code"}
 
-        attrs['created_by'] = user
+        # The request user may be a token user, so the uploader is set by id
+        attrs['created_by_id'] = user.pk
 
-        data_stream, total_upload = validate_eligible_student_upload(attrs, user, expected_headers)
-        attrs['total_upload'] = total_upload
-        self.data_stream = data_stream
+        attrs['total_upload'] = validate_eligible_student_upload(attrs, user, expected_headers)
 
         return attrs
 
     @transaction.atomic()
     def create(self, validated_data):
-        user = self.context['request'].user
-        data = validated_data.copy()
         file_upload = super().create(validated_data)
-        data['data_stream'] = self.data_stream
-        handle_file_upload(data['data_stream'], file_upload, user)
+        # The worker re-reads the stored file, so only the upload id goes through the broker
+        transaction.on_commit(lambda: handle_file_upload.delay(file_upload.pk))
 
         return file_upload
 
 
+class EligibleUserUploadStatusSerializer(serializers.ModelSerializer):
+    """
+    Progress of an upload, with its throughput and ETA. While it is processing, the counters come
+    live from the cache (see `UploadProgress`), falling back to the ones last flushed to the upload.
+    """
+
+    class Meta:
+        model = EligibleUserUpload
+        fields = ['id', 'status', 'total_upload', 'rows_processed', 'number_of_valid', 'number_of_invalid',
+                  'number_of_unchanged', 'error_file', 'duplicate_of', 'failure_reason', 'processing_started_at',
+                  'created_at']
+
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        stats = UploadProgress(instance.pk).get() if instance.status == BulkStatusEnum.Started.value else None
+        if stats is None:
+            finished_at = timezone.now() if instance.status == BulkStatusEnum.Started.value else instance.updated_at
+            elapsed = (finished_at - instance.processing_started_at).total_seconds() \
+                if instance.processing_started_at else 0
+            stats = progress_stats(instance.total_upload, instance.rows_processed, instance.number_of_valid,
+                                   instance.number_of_unchanged, elapsed)
+        data.update(stats)
+        return data
+
+
 class ListUserSerializer(serializers.ModelSerializer):
     department_name = serializers.CharField(max_length=100)
 
@@ -54,6 +80,18 @@ class ListUserSerializer(serializers.ModelSerializer):
         fields = ['firstname', 'lastname', 'email', 'phone', "matric_no", "department_name", "middle_name"]
 
 
+class ListUserValuesSerializer(serializers.BaseSerializer):
+    """
+    Read-only twin of `ListUserSerializer` for rows fetched with `.values()`. Every field is a
+    string or None, so the dicts are copied as they are instead of going through model instances
+    and serializer fields.
+    """
+    field_names = ListUserSerializer.Meta.fields
+
+    def to_representation(self, instance):
+        return {field: instance[field] for field in self.field_names}
+
+
 class AuthTokenSerializer(serializers.Serializer):
     """Serializer for user authentication object"""
     email = serializers.CharField()
@@ -80,4 +118,23 @@ class AuthTokenSerializer(serializers.Serializer):
 
 
 class CustomObtainTokenPairSerializer(TokenObtainPairSerializer):
-    pass
+    """Adds the claims `StatelessJWTAuthentication` builds the request user from."""
+
+    @classmethod
+    def get_token(cls, user):
+        token = super().get_token(user)
+        token['role'] = user.role
+        token['is_active'] = user.is_active
+        token['token_version'] = user.token_version
+        return token
+
+
+class CustomTokenRefreshSerializer(TokenRefreshSerializer):
+    """Refuses refresh tokens revoked by a `token_version` bump."""
+
+    def validate(self, attrs):
+        refresh = self.token_class(attrs['refresh'])
+        if 'token_version' in refresh and refresh['token_version'] != get_token_version(
+                refresh[jwt_settings.USER_ID_CLAIM]):
+            raise InvalidToken(_("Token has been revoked"))
+        return super().validate(attrs)
@@ -1,8 +1,8 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from user.v1.views import AuthViewSets, CustomObtainTokenPairView, CreateTokenView
+from user.v1.views import AuthViewSets, CustomObtainTokenPairView, CreateTokenView, CustomTokenRefreshView
 
-from rest_framework_simplejwt.views import (TokenRefreshView, TokenVerifyView)
+from rest_framework_simplejwt.views import TokenVerifyView
 
 app_name = 'user'
 
@@ -12,6 +12,6 @@ router.register('users', AuthViewSets)
 urlpatterns = [
     path('', include(router.urls)),
     path('login/', CustomObtainTokenPairView.as_view(), name='login'),
-    path('token/refresh/', TokenRefreshView.as_view(), name='refresh-token'),
+    path('token/refresh/', CustomTokenRefreshView.as_view(), name='refresh-token'),
     path('token/verify/', TokenVerifyView.as_view(), name='verify-token'),
 ]
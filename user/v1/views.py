@@ -1,9 +1,8 @@
 from rest_framework.authtoken.views import ObtainAuthToken
 from rest_framework.settings import api_settings
-from user.models import Token, User
-from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
+from user.models import Token, User, EligibleUserUpload
 from user.permissions import IsAdmin, IsAdminOrSuperAdmin
-from rest_framework_simplejwt.views import TokenObtainPairView
+from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import filters
 from rest_framework import viewsets, status
@@ -12,33 +11,97 @@ from rest_framework.permissions import IsAuthenticated, AllowAny
 from rest_framework.response import Response
 from user.v1.serializers import *
 from django.db.models import F
+from common.pagination import KeysetCursorPagination
+from user.search import UserSearchFilter
+from user.cache import user_list_cache_key
+from django.conf import settings
+from django.http import StreamingHttpResponse
+from rest_framework.exceptions import ValidationError
+from user.utils import stream_csv_rows, stream_ndjson_rows
+from django.core.cache import cache
+from django.shortcuts import get_object_or_404
+from drf_spectacular.utils import OpenApiParameter, extend_schema
 
 
 class AuthViewSets(viewsets.ModelViewSet):
-    queryset = get_user_model().objects.exclude(is_superuser=True).annotate(
+    queryset = get_user_model().objects.filter(is_superuser=False).annotate(
         department_name=F('department__name')
     )
     serializer_class = ListUserSerializer
+    pagination_class = KeysetCursorPagination
     http_method_names = ['get', 'post', ]
-    filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
+    filter_backends = [DjangoFilterBackend, UserSearchFilter, filters.OrderingFilter]
     search_fields = ['email', 'firstname', 'lastname', 'phone', 'role']
     ordering_fields = ['created_at', 'last_login',
                        'email', 'firstname', 'lastname', 'phone']
+    # `?format=` is taken by DRF's content negotiation, hence `?export_format=`
+    export_formats = {
+        'csv': ('text/csv', stream_csv_rows),
+        'ndjson': ('application/x-ndjson', stream_ndjson_rows),
+    }
 
     def get_queryset(self):
         return super().get_queryset()
 
+    def list(self, request, *args, **kwargs):
+        # The key is taken before querying, so a version bump meanwhile leaves this page under the old version
+        cache_key = user_list_cache_key(request)
+        data = cache.get(cache_key)
+        if data is None:
+            data = self.list_values(request).data
+            cache.set(cache_key, data, timeout=settings.USER_LIST_CACHE_TIMEOUT)
+        return Response(data)
+
+    def list_values(self, request):
+        """
+        The list through `.values()`: only the listed columns, plus the primary key and ordering
+        fields the keyset pagination reads, are selected and rendered.
+        """
+        columns = dict.fromkeys([*ListUserValuesSerializer.field_names, *self.ordering_fields, 'id'])
+        queryset = self.filter_queryset(self.get_queryset()).values(*columns)
+        page = self.paginate_queryset(queryset)
+        if page is None:
+            return Response(ListUserValuesSerializer(queryset, many=True).data)
+        return self.get_paginated_response(ListUserValuesSerializer(page, many=True).data)
+
     def create(self, request, *args, **kwargs):
         return Response(status=status.HTTP_405_METHOD_NOT_ALLOWED)
 
+    @action(methods=['GET'], detail=False, permission_classes=[IsAuthenticated, IsAdminOrSuperAdmin],
+            url_path='export')
+    def export(self, request):
+        """
+        Stream every user matching the list's search, filter and ordering parameters as CSV, or as
+        NDJSON with `?export_format=ndjson`, reading them through a server-side cursor.
+        """
+        export_format = request.query_params.get('export_format', 'csv')
+        if export_format not in self.export_formats:
+            raise ValidationError({'export_format': f"Must be one of {', '.join(self.export_formats)}."})
+        content_type, stream_rows = self.export_formats[export_format]
+
+        fields = ListUserValuesSerializer.field_names
+        rows = self.filter_queryset(self.get_queryset()).values(*fields).iterator(
+            chunk_size=settings.USER_EXPORT_CHUNK_SIZE)
+        response = StreamingHttpResponse(stream_rows(rows, fields), content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="users.{export_format}"'
+        return response
+
+    @extend_schema(parameters=[OpenApiParameter('upload_id', str, OpenApiParameter.PATH)])
+    @action(methods=['GET'], detail=False, permission_classes=[IsAuthenticated, IsAdminOrSuperAdmin],
+            serializer_class=EligibleUserUploadStatusSerializer, url_path=r'uploads/(?P<upload_id>[^/.]+)')
+    def upload_status(self, request, upload_id=None):
+        """Progress of an upload started through `upload-users`, cheap enough to poll."""
+        file_upload = get_object_or_404(EligibleUserUpload, pk=upload_id)
+        return Response(EligibleUserUploadStatusSerializer(file_upload, context={'request': request}).data)
+
     @action(methods=['POST'], detail=False, permission_classes=[IsAuthenticated, IsAdminOrSuperAdmin],
             serializer_class=EligibleUserUploadSerializer,
             url_path='upload-users')
     def upload_user(self, request, pk=None):
         serializer = EligibleUserUploadSerializer(data=request.data, context={'request': request})
         serializer.is_valid(raise_exception=True)
-        serializer.save()
-        return Response({'success': True}, status=status.HTTP_200_OK)
+        file_upload = serializer.save()
+        return Response({'success': True, 'id': file_upload.pk}, status=status.HTTP_202_ACCEPTED)
 
 
 class CreateTokenView(ObtainAuthToken):
@@ -64,4 +127,8 @@ class CreateTokenView(ObtainAuthToken):
 
 class CustomObtainTokenPairView(TokenObtainPairView):
     """Login with email and password"""
-    serializer_class = TokenObtainPairSerializer
+    serializer_class = CustomObtainTokenPairSerializer
+
+
+class CustomTokenRefreshView(TokenRefreshView):
+    serializer_class = CustomTokenRefreshSerializer